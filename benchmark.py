@@ -0,0 +1,309 @@
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import create_shipping_data
+import shipping_discount_calculator as shipping
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+RESULTS_VERSION = 1
+RSS_POLL_SECONDS = 0.02
+MODES = ('sequential', 'parallel', 'auto', 'stream', 'compile', 'compiled', 'locked')
+DEFAULT_MODES = ('sequential', 'parallel', 'auto', 'stream', 'compile', 'compiled')
+
+
+def generate_dataset(path, target_bytes, seed=0):
+    dataset = create_shipping_data.generate_large_input_file(path, target_bytes / (1024 * 1024 * 1024), seed=seed,
+                                                             processes=shipping.available_cpus())
+    return {'path': path, 'bytes': dataset['bytes'], 'lines': dataset['lines'], 'seed': seed}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_sequential(input_file, output_file, lock=None):
+    calculator = shipping.ShippingCalculator()
+    with open(input_file, 'r', encoding='utf-8', errors='surrogateescape') as source, \
+            open(output_file, 'w', encoding='utf-8', errors='surrogateescape') as destination:
+        for line in source:
+            if lock:
+                with lock:
+                    result = calculator.process_transaction(line)
+            else:
+                result = calculator.process_transaction(line)
+            if result:
+                destination.write(result + '\n')
+
+
+def run_mode(mode, input_file, output_file, processes):
+    if mode == 'sequential':
+        run_sequential(input_file, output_file)
+    elif mode == 'parallel':
+        shipping.process_file_parallel(input_file, output_file, processes)
+    elif mode == 'auto':
+        shipping.process_file_parallel(input_file, output_file, 'auto')
+    elif mode == 'stream':
+        shipping.process_file_stream(input_file, output_file)
+    elif mode == 'compile':
+        shipping.compile_input_file(input_file, output_file)
+    elif mode == 'compiled':
+        shipping.process_file_parallel(input_file, output_file)
+    elif mode == 'locked':
+        run_sequential(input_file, output_file, mp.Lock())
+    else:
+        raise ValueError(f"Unknown benchmark mode '{mode}'")
+
+
+def child_main(args):
+    start = time.perf_counter()
+    run_mode(args.run, args.input, args.output, args.processes)
+    elapsed = time.perf_counter() - start
+
+    peak_rss_mb = None
+    if RESOURCE_AVAILABLE:
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        peak_rss_mb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale
+
+    with open(args.result, 'w') as f:
+        json.dump({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb}, f)
+
+
+def poll_tree_rss(pid, peak, done):
+    try:
+        root = psutil.Process(pid)
+        while not done.is_set():
+            total = 0
+            for process in [root] + root.children(recursive=True):
+                try:
+                    total += process.memory_info().rss
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+            peak[0] = max(peak[0], total)
+            done.wait(RSS_POLL_SECONDS)
+    except psutil.NoSuchProcess:
+        pass
+
+
+def measure(mode, input_file, output_file, processes, work_dir):
+    result_file = os.path.join(work_dir, 'result.json')
+    log_file = os.path.join(work_dir, f'{mode}.log')
+    command = [sys.executable, os.path.abspath(__file__), '--run', mode, '--input', input_file,
+               '--output', output_file, '--result', result_file]
+    if processes:
+        command += ['--processes', str(processes)]
+
+    with open(log_file, 'w') as log:
+        child = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        peak = [0]
+        done = threading.Event()
+        poller = None
+        if PSUTIL_AVAILABLE:
+            poller = threading.Thread(target=poll_tree_rss, args=(child.pid, peak, done), daemon=True)
+            poller.start()
+        child.wait()
+        done.set()
+        if poller:
+            poller.join()
+
+    if child.returncode != 0 or not os.path.exists(result_file):
+        with open(log_file, errors='replace') as log:
+            raise RuntimeError(f"Benchmark mode '{mode}' failed:\n{log.read()[-2000:]}")
+
+    with open(result_file) as f:
+        result = json.load(f)
+    os.unlink(result_file)
+
+    if PSUTIL_AVAILABLE:
+        result['peak_rss_mb'] = peak[0] / (1024 * 1024)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    os.makedirs(args.data_dir, exist_ok=True)
+    target_bytes = int(shipping.parse_memory_size(args.size) * 1024 * 1024)
+    input_file = os.path.join(args.data_dir, f"bench_{target_bytes // (1024 * 1024)}mb_seed{args.seed}.txt")
+    meta_file = input_file + '.json'
+
+    if os.path.exists(meta_file) and os.path.exists(input_file) and not args.regenerate:
+        with open(meta_file) as f:
+            dataset = json.load(f)
+    else:
+        print(f"Generating {target_bytes / (1024 * 1024):,.0f} MB dataset with seed {args.seed}...")
+        start = time.perf_counter()
+        dataset = generate_dataset(input_file, target_bytes, args.seed)
+        dataset['generate_seconds'] = time.perf_counter() - start
+        dataset['sha256'] = file_sha256(input_file)
+        with open(meta_file, 'w') as f:
+            json.dump(dataset, f, indent=2)
+
+    compiled_file = os.path.join(args.data_dir, os.path.basename(input_file) + '.col')
+    results = []
+    reference = None
+
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as work_dir:
+        output_file = os.path.join(work_dir, 'output.txt')
+        runs = []
+        for mode in args.modes:
+            if mode == 'parallel':
+                runs.extend((mode, processes) for processes in args.processes)
+            else:
+                runs.append((mode, None))
+
+        if 'compiled' in args.modes and 'compile' not in args.modes:
+            measure('compile', input_file, compiled_file, None, work_dir)
+
+        for mode, processes in runs:
+            source = compiled_file if mode == 'compiled' else input_file
+            target = compiled_file if mode == 'compile' else output_file
+            best = None
+            peak_rss_mb = None
+
+            for _ in range(args.repeat):
+                measured = measure(mode, source, target, processes, work_dir)
+                if best is None or measured['seconds'] < best:
+                    best = measured['seconds']
+                if measured['peak_rss_mb'] is not None:
+                    peak_rss_mb = max(peak_rss_mb or 0.0, measured['peak_rss_mb'])
+
+            output_sha256 = None
+            if mode != 'compile':
+                output_sha256 = file_sha256(output_file)
+                reference = reference or output_sha256
+
+            result = {
+                'mode': mode,
+                'processes': processes,
+                'seconds': best,
+                'lines_per_second': dataset['lines'] / best,
+                'mb_per_second': dataset['bytes'] / (1024 * 1024) / best,
+                'peak_rss_mb': peak_rss_mb,
+                'output_sha256': output_sha256,
+                'output_matches': output_sha256 is None or output_sha256 == reference
+            }
+            results.append(result)
+            print_result(result)
+
+        if os.path.exists(compiled_file):
+            os.unlink(compiled_file)
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': shipping.available_cpus(),
+        'numpy': shipping.NUMPY_AVAILABLE,
+        'repeat': args.repeat,
+        'dataset': dataset,
+        'results': results
+    }
+
+
+def result_name(result):
+    return f"{result['mode']}-p{result['processes']}" if result['processes'] else result['mode']
+
+
+def print_result(result):
+    rss = f"{result['peak_rss_mb']:,.0f} MB" if result['peak_rss_mb'] is not None else "n/a"
+    check = "" if result['output_matches'] else "  OUTPUT DIFFERS"
+    print(f"{result_name(result):<14} {result['seconds']:>8.2f} s {result['lines_per_second']:>14,.0f} lines/s "
+          f"{result['mb_per_second']:>9,.1f} MB/s {rss:>10} peak RSS{check}")
+
+
+def print_comparison(report, baseline):
+    previous = {result_name(result): result for result in baseline['results']}
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} ({baseline['dataset']['bytes'] / (1024 * 1024):,.0f} MB):")
+
+    for result in report['results']:
+        old = previous.get(result_name(result))
+        if old is None:
+            continue
+        change = (result['lines_per_second'] / old['lines_per_second'] - 1) * 100
+        print(f"{result_name(result):<14} {old['lines_per_second']:>14,.0f} -> {result['lines_per_second']:>14,.0f} lines/s "
+              f"({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproducible benchmarks for the shipping discount calculator")
+    parser.add_argument('--size', default='64M', help="Dataset size, such as 64M or 1.5G")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', default=','.join(DEFAULT_MODES), help=f"Comma-separated modes from {', '.join(MODES)}")
+    parser.add_argument('--processes', '-p', help="Comma-separated process counts for the parallel mode")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per mode; the fastest is reported")
+    parser.add_argument('--data-dir', default='benchmark_data', help="Where datasets are generated and cached")
+    parser.add_argument('--regenerate', action='store_true', help="Regenerate the dataset even if it is cached")
+    parser.add_argument('--json', default='benchmark_results.json', help="Where to store the results")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        args.processes = int(args.processes) if args.processes else None
+        child_main(args)
+        return
+
+    args.modes = [mode.strip() for mode in args.modes.split(',')]
+    unknown = [mode for mode in args.modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+
+    cpus = shipping.available_cpus()
+    if args.processes:
+        args.processes = [int(processes) for processes in args.processes.split(',')]
+    else:
+        args.processes = sorted({processes for processes in (1, 2, 4, cpus) if processes <= cpus})
+
+    report = run_benchmarks(args)
+
+    with open(args.json, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+
+    if not all(result['output_matches'] for result in report['results']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
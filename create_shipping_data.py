@@ -1,61 +1,199 @@
+import argparse
+import multiprocessing as mp
 import random
-from datetime import datetime, timedelta
-import os
-
-def generate_large_input_file(filename, target_size_gb=1.5):
-    # Define possible values
-    package_sizes = ['S', 'M', 'L']
-    carriers = ['MR', 'LP']
-    
-    # Convert target size to bytes
-    target_size_bytes = target_size_gb * 1024 * 1024 * 1024
-    
-    # Start date (January 1, 2015)
-    start_date = datetime(2015, 1, 1)
-    
-    # Open file for writing
-    with open(filename, 'w') as f:
-        current_size = 0
-        
-        # Keep writing until we reach the target file size
-        while current_size < target_size_bytes:
-            # Generate a batch of entries to improve performance
-            batch = []
-            
-            for _ in range(10000):  # Write in batches of 10,000 entries
-                # Generate a random date within a 3-year period
-                random_days = random.randint(0, 365 * 3)  # Up to 3 years
-                current_date = start_date + timedelta(days=random_days)
-                date_str = current_date.strftime("%Y-%m-%d")
-                
-                # Occasionally generate an invalid entry (1% chance)
-                if random.random() < 0.01:
-                    invalid_entries = [
-                        f"{date_str} CUSPS",
-                        f"{date_str} X LP",
-                        f"{date_str} S XX",
-                        f"{date_str} S",
-                        f"invalid-date S MR"
-                    ]
-                    batch.append(random.choice(invalid_entries))
-                else:
-                    # Generate a valid entry
-                    package_size = random.choice(package_sizes)
-                    carrier = random.choice(carriers)
-                    batch.append(f"{date_str} {package_size} {carrier}")
-            
-            # Join batch with newlines and write to file
-            batch_text = '\n'.join(batch) + '\n'
-            f.write(batch_text)
-            
-            # Update current size
-            current_size = os.path.getsize(filename)
-            
-            # Print progress
+import time
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+START_DATE = date(2015, 1, 1)
+DATE_DAYS = 365 * 3 + 1
+PACKAGE_SIZES = ['S', 'M', 'L']
+CARRIERS = ['MR', 'LP']
+BLOCK_ROWS = 1024 * 1024
+TASKS_PER_PROCESS = 4
+INVALID_KINDS = {
+    'word': lambda day: f"{day} CUSPS",
+    'size': lambda day: f"{day} X LP",
+    'carrier': lambda day: f"{day} S XX",
+    'missing': lambda day: f"{day} S",
+    'date': lambda day: "invalid-date S MR"
+}
+
+generator = None
+
+
+class RowGenerator:
+    def __init__(self, seed=0, invalid_rate=0.01, invalid_mix=None):
+        mix = invalid_mix or {kind: 1 for kind in INVALID_KINDS}
+        unknown = set(mix) - set(INVALID_KINDS)
+        if unknown:
+            raise ValueError(f"Unknown invalid row kinds: {', '.join(sorted(unknown))}")
+        if not 0 <= invalid_rate <= 1:
+            raise ValueError(f"Invalid row rate must be between 0 and 1, got {invalid_rate}")
+
+        self.seed = seed
+        dates = [(START_DATE + timedelta(days=day)).strftime("%Y-%m-%d") for day in range(DATE_DAYS)]
+
+        categories = [[f"{day} {size} {carrier}" for day in dates for size in PACKAGE_SIZES for carrier in CARRIERS]]
+        weights = [1 - invalid_rate]
+        total_mix = sum(mix.values())
+        for kind, weight in mix.items():
+            categories.append(sorted({INVALID_KINDS[kind](day) for day in dates}))
+            weights.append(invalid_rate * weight / total_mix if total_mix else 0)
+
+        self.rows = [f"{row}\n".encode() for category in categories for row in category]
+        self.counts = [len(category) for category in categories]
+        self.offsets = [sum(self.counts[:i]) for i in range(len(categories))]
+        self.weights = [weight / sum(weights) for weight in weights]
+
+        self.expected_row_bytes = sum(
+            weight * sum(len(self.rows[offset + i]) for i in range(count)) / count
+            for weight, offset, count in zip(self.weights, self.offsets, self.counts))
+
+        if NUMPY_AVAILABLE:
+            self.table = np.array(self.rows, dtype=object)
+            self.lengths = np.array([len(row) for row in self.rows])
+            self.category_counts = np.array(self.counts)
+            self.category_offsets = np.array(self.offsets)
+
+    def draw(self, block, rows):
+        if NUMPY_AVAILABLE:
+            rng = np.random.default_rng([self.seed, block])
+            category = rng.choice(len(self.weights), size=rows, p=self.weights)
+            return self.category_offsets[category] + (rng.random(rows) * self.category_counts[category]).astype(np.int64)
+
+        rng = random.Random(f"{self.seed}-{block}")
+        categories = rng.choices(range(len(self.weights)), weights=self.weights, k=rows)
+        return [self.offsets[category] + int(rng.random() * self.counts[category]) for category in categories]
+
+    def block_size(self, block, rows):
+        indices = self.draw(block, rows)
+        if NUMPY_AVAILABLE:
+            return int(self.lengths[indices].sum())
+        return sum(len(self.rows[index]) for index in indices)
+
+    def block_bytes(self, block, rows):
+        indices = self.draw(block, rows)
+        if NUMPY_AVAILABLE:
+            return b''.join(self.table[indices].tolist())
+        return b''.join([self.rows[index] for index in indices])
+
+
+def plan_blocks(target_bytes, row_generator):
+    total_rows = max(1, int(-(-target_bytes // row_generator.expected_row_bytes)))
+    return [min(BLOCK_ROWS, total_rows - start) for start in range(0, total_rows, BLOCK_ROWS)]
+
+
+def init_generator(seed, invalid_rate, invalid_mix):
+    global generator
+    generator = RowGenerator(seed, invalid_rate, invalid_mix)
+
+
+def measure_blocks(args):
+    first_block, block_rows = args
+    return [generator.block_size(first_block + i, rows) for i, rows in enumerate(block_rows)]
+
+
+def write_blocks(args):
+    path, offset, first_block, block_rows = args
+    written = 0
+
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        for i, rows in enumerate(block_rows):
+            data = generator.block_bytes(first_block + i, rows)
+            f.write(data)
+            written += len(data)
+
+    return written
+
+
+def split_tasks(blocks, num_tasks):
+    step = -(-len(blocks) // max(num_tasks, 1))
+    return [(start, blocks[start:start + step]) for start in range(0, len(blocks), step)]
+
+
+def generate_large_input_file(filename, target_size_gb=1.5, seed=0, invalid_rate=0.01, invalid_mix=None,
+                              processes=1, shards=None):
+    target_size_bytes = int(target_size_gb * 1024 * 1024 * 1024)
+    row_generator = RowGenerator(seed, invalid_rate, invalid_mix)
+    blocks = plan_blocks(target_size_bytes, row_generator)
+
+    global generator
+    generator = row_generator
+    initargs = (seed, invalid_rate, invalid_mix)
+
+    if shards:
+        paths = [f"{filename}.{shard:03d}" for shard in range(shards)]
+        tasks = split_tasks(blocks, shards)
+        jobs = [(path, 0, first_block, block_rows) for path, (first_block, block_rows) in zip(paths, tasks)]
+        for path in paths:
+            open(path, 'wb').close()
+    else:
+        paths = [filename]
+        tasks = split_tasks(blocks, processes * TASKS_PER_PROCESS if processes > 1 else 1)
+        if processes > 1:
+            with mp.Pool(processes, initializer=init_generator, initargs=initargs) as pool:
+                task_sizes = [sum(sizes) for sizes in pool.map(measure_blocks, tasks)]
+        else:
+            task_sizes = [0]
+
+        with open(filename, 'wb') as f:
+            f.truncate(sum(task_sizes))
+
+        offsets = [sum(task_sizes[:i]) for i in range(len(tasks))]
+        jobs = [(filename, offset, first_block, block_rows) for offset, (first_block, block_rows) in zip(offsets, tasks)]
+
+    current_size = 0
+    if processes > 1:
+        with mp.Pool(processes, initializer=init_generator, initargs=initargs) as pool:
+            for written in pool.imap_unordered(write_blocks, jobs):
+                current_size += written
+                print(f"Generated {current_size / (1024 * 1024 * 1024):.2f} GB", end='\r')
+    else:
+        for job in jobs:
+            current_size += write_blocks(job)
             print(f"Generated {current_size / (1024 * 1024 * 1024):.2f} GB", end='\r')
-        
-        print(f"\nCompleted! Generated file size: {current_size / (1024 * 1024 * 1024):.2f} GB")
+
+    print(f"\nCompleted! Generated {sum(blocks):,} rows, {current_size / (1024 * 1024 * 1024):.2f} GB "
+          f"in {len(paths)} file{'s' if len(paths) > 1 else ''}")
+
+    return {'paths': paths, 'bytes': current_size, 'lines': sum(blocks)}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        mix[kind.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate random shipping transactions for testing and benchmarks")
+    parser.add_argument('filename', nargs='?', default='input.txt')
+    parser.add_argument('--size-gb', type=float, default=1.5, help="Target output size in GB")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--invalid-rate', type=float, default=0.01, help="Fraction of rows that are invalid")
+    parser.add_argument('--invalid-mix', type=parse_mix,
+                        help=f"Weights of the invalid row kinds, such as date=2,missing=1 (kinds: {', '.join(INVALID_KINDS)})")
+    parser.add_argument('--processes', '-p', type=int, default=mp.cpu_count())
+    parser.add_argument('--shards', type=int, help="Write this many separate files instead of one")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        generate_large_input_file(args.filename, args.size_gb, args.seed, args.invalid_rate, args.invalid_mix,
+                                  max(1, args.processes), args.shards)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"File generation complete in {time.perf_counter() - start:.1f} s!")
+
 
 if __name__ == "__main__":
-    generate_large_input_file("input.txt")
-    print("File generation complete!")
\ No newline at end of file
+    main()
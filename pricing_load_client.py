@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+
+def generate_transactions(count, seed=0):
+    rng = random.Random(seed)
+    start_date = datetime(2015, 1, 1)
+    package_sizes = ['S', 'M', 'L']
+    carriers = ['MR', 'LP']
+
+    transactions = []
+    for i in range(count):
+        date_str = (start_date + timedelta(days=i * 365 // max(count, 1))).strftime("%Y-%m-%d")
+        transactions.append(f"{date_str} {rng.choice(package_sizes)} {rng.choice(carriers)}\n".encode())
+    return transactions
+
+
+async def run_connection(args, transactions, latencies):
+    if args.socket:
+        reader, writer = await asyncio.open_unix_connection(args.socket)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+
+    send_times = deque()
+    capacity = asyncio.Event()
+
+    async def receive():
+        for _ in range(len(transactions)):
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Server closed the connection early")
+            latencies.append(time.perf_counter() - send_times.popleft())
+            capacity.set()
+
+    receiver = asyncio.create_task(receive())
+    sent = 0
+
+    while sent < len(transactions):
+        window = min(args.pipeline - len(send_times), len(transactions) - sent)
+        if window <= 0:
+            capacity.clear()
+            await capacity.wait()
+            continue
+
+        now = time.perf_counter()
+        send_times.extend([now] * window)
+        writer.write(b''.join(transactions[sent:sent + window]))
+        sent += window
+        await writer.drain()
+
+    await receiver
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_load(args):
+    transactions = generate_transactions(args.requests, args.seed)
+    latencies = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_connection(args, transactions, latencies) for _ in range(args.connections)))
+    elapsed = time.perf_counter() - start
+
+    return elapsed, sorted(latencies)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the shipping discount pricing service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="Unix socket path (overrides --host/--port)")
+    parser.add_argument('--connections', type=int, default=4, help="Concurrent client connections")
+    parser.add_argument('--requests', type=int, default=100000, help="Transactions sent per connection")
+    parser.add_argument('--pipeline', type=int, default=256, help="Maximum unanswered transactions per connection")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    elapsed, latencies = asyncio.run(run_load(args))
+    total = len(latencies)
+
+    print(f"Transactions: {total:,} over {args.connections} connections")
+    print(f"Elapsed:      {elapsed:.2f} s")
+    print(f"Throughput:   {total / elapsed:,.0f} transactions/s")
+    print(f"Latency p50:  {percentile(latencies, 0.50) * 1000:.2f} ms")
+    print(f"Latency p99:  {percentile(latencies, 0.99) * 1000:.2f} ms")
+    print(f"Latency max:  {latencies[-1] * 1000 if latencies else 0.0:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
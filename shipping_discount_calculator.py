@@ -4,10 +4,78 @@ import os
 import signal
 import multiprocessing as mp
 import threading
-from datetime import datetime
+import mmap
+import shutil
+import tempfile
+import json
+import hashlib
+import asyncio
+import queue
+import zlib
+import gzip
+import bz2
+import bisect
+import struct
+import re
+import tracemalloc
+import pickle
+import cProfile
+import pstats
+import http.server
+from array import array
+from datetime import datetime, date, timedelta
 from collections import defaultdict
+from itertools import islice
 
 terminate_flag = False
+worker_progress = None
+
+OUTPUT_BATCH_LINES = 10000
+BATCH_LINE_BYTES = 16
+TASK_CHUNK_BYTES = 8 * 1024 * 1024
+MIN_TASKS_PER_PROCESS = 4
+DATE_CACHE_SIZE = 4096
+MISSING = object()
+RESULT_SAMPLE_SIZE = 1000
+STREAM_BLOCK_SIZE = 1024 * 1024
+SERVER_READ_SIZE = 64 * 1024
+SERVER_MAX_PENDING = 64
+SERVER_MIN_BATCH_LINES = 32
+COMPRESSED_READ_SIZE = 1024 * 1024
+COMPRESSED_BLOCK_SIZE = 4 * 1024 * 1024
+COMPRESSED_QUEUE_BLOCKS = 4
+BZ2_STREAM_MAGIC = b'1AY&SY'
+COMPILED_MAGIC = b'SHIPCOL1'
+COMPILED_VERSION = 1
+COMPILED_EXCEPTION_CODE = 255
+COMPILED_BATCH_ROWS = 256 * 1024
+COMPILED_EPOCH = date(1970, 1, 1)
+CHECKPOINT_VERSION = 1
+CHECKPOINT_FINGERPRINT_BYTES = 4096
+MONTH_INDEX_VERSION = 1
+TIMING_REPORT_VERSION = 1
+PROFILE_TOP_FUNCTIONS = 15
+METRICS_VERSION = 1
+METRICS_INTERVAL_SECONDS = 5
+DATE_PATTERN = re.compile(r'(\d{4})-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])')
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+REJECT_REASONS = {
+    'bad_field_count': "Bad field count",
+    'bad_date': "Bad date",
+    'unknown_size': "Unknown size",
+    'unknown_provider': "Unknown provider"
+}
+MONTH_INDEX_BLOCK_SIZE = 256 * 1024
+AUTO_TUNE_SAMPLE_BYTES = 4 * 1024 * 1024
+AUTO_TUNE_MIN_SAMPLE_BYTES = 256 * 1024
+AUTO_TUNE_BATCH_SIZES = (1000, 2500, 5000, 10000, 25000, 50000)
+AUTO_TUNE_DEFAULT_WORKER_MB = 64
+
+worker_batch_lines = OUTPUT_BATCH_LINES
+worker_timing = False
+worker_profiler = None
+worker_profile_dir = None
+worker_quarantine = False
 
 try:
     import psutil
@@ -15,6 +83,19 @@ try:
 except ImportError:
     PSUTIL_AVAILABLE = False
 
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+    DAYS_IN_MONTH = np.array((0,) + MONTH_DAYS)
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 def signal_handler(sig, frame):
     global terminate_flag
     print("\n\nCtrl+C detected. Shutting down...")
@@ -54,11 +135,55 @@ class RunStats:
             return f"{seconds} second{'s' if seconds != 1 else ''}"
 
 
+class StageTimer:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self.last_wall = time.perf_counter()
+        self.last_cpu = time.thread_time()
+
+    def restart(self):
+        if self.enabled:
+            self.last_wall = time.perf_counter()
+            self.last_cpu = time.thread_time()
+
+    def mark(self, stage, nbytes=0):
+        if not self.enabled:
+            return
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0.0, 0.0, 0, 0]
+
+        entry[0] += wall - self.last_wall
+        entry[1] += cpu - self.last_cpu
+        entry[2] += nbytes
+        entry[3] += 1
+        self.last_wall = wall
+        self.last_cpu = cpu
+
+    def merge(self, stages):
+        for stage, values in stages.items():
+            entry = self.stages.setdefault(stage, [0.0, 0.0, 0, 0])
+            for i, value in enumerate(values):
+                entry[i] += value
+
+    def report(self):
+        return {
+            stage: {'wall_seconds': wall, 'cpu_seconds': cpu, 'bytes': nbytes, 'calls': calls}
+            for stage, (wall, cpu, nbytes, calls) in self.stages.items()
+        }
+
+
 class SimpleProgressBar:
-    def __init__(self, total, prefix='Progress:', length=30):
+    def __init__(self, total, prefix='Progress:', length=30, unit='lines', unit_size=1):
         self.total = total
         self.prefix = prefix
         self.length = length
+        self.unit = unit
+        self.unit_size = unit_size
         self.start_time = time.time()
         self.last_update = 0
         self.iteration = 0
@@ -102,7 +227,12 @@ class SimpleProgressBar:
             items_per_second = 0
             eta_str = "ETA: --"
 
-        progress_bar = f"\r{self.BOLD}{self.prefix}{self.END} |{bar}| {percentage:.1f}% ({iteration:,}/{self.total:,}) {items_per_second:.1f} lines/s {eta_str}"
+        if self.unit_size == 1:
+            counts = f"{iteration:,}/{self.total:,}"
+        else:
+            counts = f"{iteration / self.unit_size:,.1f}/{self.total / self.unit_size:,.1f} {self.unit}"
+
+        progress_bar = f"\r{self.BOLD}{self.prefix}{self.END} |{bar}| {percentage:.1f}% ({counts}) {items_per_second / self.unit_size:.1f} {self.unit}/s {eta_str}"
         
         print(progress_bar, end='', flush=True)
 
@@ -111,8 +241,105 @@ class SimpleProgressBar:
             print(f"{self.BOLD}Finalizing process... Please wait{self.END}")
 
 
+class LowestPriceMatchRule:
+    stage = 'static'
+
+    def __init__(self, size='S'):
+        self.size = size
+
+    def get_discount(self, calculator, size, provider, base_price):
+        if size != self.size:
+            return 0.0
+
+        lowest_price = min(prices[size] for prices in calculator.prices.values() if size in prices)
+        if base_price > lowest_price:
+            return base_price - lowest_price
+        return 0.0
+
+
+class NthShipmentRule:
+    stage = 'monthly'
+
+    def __init__(self, size, provider, nth, fraction=1.0, repeat=False, counter=None):
+        self.size = size
+        self.provider = provider
+        self.nth = nth
+        self.fraction = fraction
+        self.repeat = repeat
+        self.counter = counter or f"monthly_{provider.lower()}_{size.lower()}_count"
+
+    def applies_to(self, size, provider):
+        return size == self.size and provider == self.provider
+
+    def get_discount(self, calculator, size, provider, base_price):
+        return base_price * self.fraction
+
+
+class MonthlyCapRule:
+    stage = 'cap'
+
+    def __init__(self, cap=10.0):
+        self.cap = cap
+
+
+def default_discount_rules():
+    return [
+        LowestPriceMatchRule('S'),
+        NthShipmentRule('L', 'LP', 3),
+        MonthlyCapRule(10.0),
+    ]
+
+
+def parse_date(date_str):
+    match = DATE_PATTERN.fullmatch(date_str)
+    if match is None:
+        return None
+
+    year, month, day = int(match[1]), int(match[2]), int(match[3])
+    leap = month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    if year < 1 or day > MONTH_DAYS[month - 1] + leap:
+        return None
+
+    return date(year, month, day)
+
+
+class MonthStateSummary:
+    def __init__(self, saturation_threshold):
+        self.saturation_threshold = saturation_threshold
+        self.events = []
+        self.counts = defaultdict(int)
+        self.recorded = defaultdict(int)
+        self.guaranteed_discount = 0.0
+
+    def add(self, size, provider, static_discount, monthly_rules):
+        for _, _, _, _, counter in monthly_rules:
+            self.counts[counter] += 1
+        self.record(size, provider, static_discount, monthly_rules)
+
+    def record(self, size, provider, static_discount, monthly_rules):
+        # Once the guaranteed discounts exceed the cap the month is pinned at the cap
+        # whatever state it started from, so later events can only bump the counters.
+        if self.guaranteed_discount >= self.saturation_threshold:
+            return
+
+        record = static_discount > 0
+        for _, nth, repeat, _, counter in monthly_rules:
+            if repeat or self.recorded[counter] < nth:
+                record = True
+
+        if not record:
+            return
+
+        self.events.append((size, provider))
+        self.guaranteed_discount += static_discount
+        for _, nth, repeat, amount, counter in monthly_rules:
+            self.recorded[counter] += 1
+            if repeat and self.recorded[counter] % nth == 0:
+                self.guaranteed_discount += amount
+
+
 class ShippingCalculator:
-    def __init__(self):
+    def __init__(self, rules=None):
         self.prices = {
             'LP': {'S': 1.50, 'M': 4.90, 'L': 6.90},
             'MR': {'S': 2.00, 'M': 3.00, 'L': 4.00}
@@ -120,8 +347,20 @@ class ShippingCalculator:
         self.lowest_s_price = min(self.prices[p]['S'] for p in self.prices)
         self.valid_providers = set(self.prices.keys())
         self.valid_sizes = {'S', 'M', 'L'}
+        self.rules = default_discount_rules() if rules is None else list(rules)
+
+        cap_rules = [rule for rule in self.rules if rule.stage == 'cap']
+        self.monthly_discount_cap = min(rule.cap for rule in cap_rules) if cap_rules else float('inf')
         self.monthly_discounts = defaultdict(float)
-        self.monthly_lp_l_count = defaultdict(int)
+
+        self.monthly_counters = []
+        for rule in self.rules:
+            if rule.stage != 'monthly':
+                continue
+            if rule.counter in self.monthly_counters:
+                raise ValueError(f"Duplicate monthly rule counter: {rule.counter}")
+            self.monthly_counters.append(rule.counter)
+            setattr(self, rule.counter, defaultdict(int))
 
         self.lines_processed = 0
         self.valid_lines = 0
@@ -131,47 +370,94 @@ class ShippingCalculator:
         self.provider_counts = defaultdict(int)
         self.size_counts = defaultdict(int)
 
-        self.lock = mp.Lock() if mp.current_process().name != 'MainProcess' else None
+        self.month_key_cache = {}
+        self.price_table = self.compile_price_table()
+        self.byte_price_table = {
+            key.encode(): (entry, entry[5].encode()) for key, entry in self.price_table.items()
+        }
+        self.batch_tables = None
+        self.tuning = None
+        self.stage_timer = StageTimer(False)
+        self.ignored_reasons = defaultdict(int)
+        self.quarantine = None
+
+    def compile_price_table(self):
+        static_rules = [rule for rule in self.rules if rule.stage == 'static']
+        monthly_rules = [rule for rule in self.rules if rule.stage == 'monthly']
+        price_table = {}
+
+        for provider in self.valid_providers:
+            for size in self.valid_sizes:
+                if size not in self.prices[provider]:
+                    continue
+
+                base_price = self.prices[provider][size]
+                static_discount = 0.0
+                for rule in static_rules:
+                    discount = rule.get_discount(self, size, provider, base_price)
+                    if discount > 0:
+                        static_discount += discount
+
+                entry_monthly_rules = tuple(
+                    (getattr(self, rule.counter), rule.nth, rule.repeat,
+                     rule.get_discount(self, size, provider, base_price), rule.counter)
+                    for rule in monthly_rules if rule.applies_to(size, provider)
+                )
+
+                price_table[f"{size} {provider}"] = (
+                    size, provider, base_price, static_discount,
+                    entry_monthly_rules, f" {base_price:.2f} -"
+                )
+
+        return price_table
     
     def get_month_key(self, date):
         return date.strftime("%Y-%m")
+
+    def parse_month_key(self, date_str):
+        try:
+            return self.month_key_cache[date_str]
+        except KeyError:
+            pass
+
+        day = parse_date(date_str)
+        month_key = None if day is None else self.get_month_key(day)
+
+        if len(self.month_key_cache) >= DATE_CACHE_SIZE:
+            self.month_key_cache.clear()
+        self.month_key_cache[date_str] = month_key
+
+        return month_key
     
     def calculate_discount(self, date, size, provider):
-        if provider not in self.valid_providers or size not in self.valid_sizes:
+        return self.calculate_month_discount(self.get_month_key(date), size, provider)
+
+    def calculate_month_discount(self, month_key, size, provider):
+        entry = self.price_table.get(f"{size} {provider}")
+        if entry is None:
             return None
 
+        return self.apply_price_entry(month_key, entry)
+
+    def apply_price_entry(self, month_key, entry):
+        size, provider, base_price, discount, monthly_rules, _ = entry
+
         self.provider_counts[provider] += 1
         self.size_counts[size] += 1
-        
-        base_price = self.prices[provider][size]
-        discount = 0.0
-        month_key = self.get_month_key(date)
-
-        if size == 'S' and base_price > self.lowest_s_price:
-            discount += base_price - self.lowest_s_price
-
-        if provider == 'LP' and size == 'L':
-            if self.lock:
-                with self.lock:
-                    self.monthly_lp_l_count[month_key] += 1
-                    if self.monthly_lp_l_count[month_key] == 3:
-                        discount += base_price
-            else:
-                self.monthly_lp_l_count[month_key] += 1
-                if self.monthly_lp_l_count[month_key] == 3:
-                    discount += base_price
-
-        if self.lock:
-            with self.lock:
-                available_discount = 10.0 - self.monthly_discounts[month_key]
-                applicable_discount = min(discount, available_discount)
-                self.monthly_discounts[month_key] += applicable_discount
-                self.total_discount_applied += applicable_discount
-        else:
-            available_discount = 10.0 - self.monthly_discounts[month_key]
-            applicable_discount = min(discount, available_discount)
-            self.monthly_discounts[month_key] += applicable_discount
-            self.total_discount_applied += applicable_discount
+
+        for counts, nth, repeat, amount, _ in monthly_rules:
+            counts[month_key] += 1
+            count = counts[month_key]
+            if count == nth or (repeat and count % nth == 0):
+                discount += amount
+
+        if not discount and month_key in self.monthly_discounts:
+            return base_price, 0.0, base_price
+
+        available_discount = self.monthly_discount_cap - self.monthly_discounts[month_key]
+        applicable_discount = min(discount, available_discount)
+        self.monthly_discounts[month_key] += applicable_discount
+        self.total_discount_applied += applicable_discount
 
         final_price = base_price - applicable_discount
         
@@ -183,36 +469,583 @@ class ShippingCalculator:
         line = line.strip()
         if not line:
             self.ignored_lines += 1
+            self.record_rejection('bad_field_count', line)
             return ""
-        
-        parts = line.split()
 
-        if len(parts) != 3:
-            self.ignored_lines += 1
-            return f"{line} Ignored"
-        
-        date_str, size, provider = parts
-        
-        try:
-            date = datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            self.ignored_lines += 1
-            return f"{line} Ignored"
-        
-        result = self.calculate_discount(date, size, provider)
+        date_str, _, suffix = line.partition(' ')
+        entry = self.price_table.get(suffix)
+
+        if entry is None or not date_str.isprintable():
+            parts = line.split()
+
+            if len(parts) != 3:
+                return self.reject(line, 'bad_field_count')
+
+            date_str, size, provider = parts
+            entry = self.price_table.get(f"{size} {provider}")
+            if entry is None:
+                return self.reject(line, self.classify_fields(size, provider))
         
-        if result is None:
-            self.ignored_lines += 1
-            return f"{line} Ignored"
+        month_key = self.parse_month_key(date_str)
+        if month_key is None:
+            return self.reject(line, 'bad_date')
         
         self.valid_lines += 1
-        base_price, discount, final_price = result
+        base_price, discount, final_price = self.apply_price_entry(month_key, entry)
 
-        if discount > 0:
+        if discount == 0:
+            return line + entry[5]
+        elif discount > 0:
             return f"{line} {final_price:.2f} {discount:.2f}"
         else:
             return f"{line} {final_price:.2f} -"
 
+    def _compile_batch_tables(self):
+        providers = sorted(self.valid_providers)
+        sizes = sorted(self.valid_sizes)
+
+        codes = [(provider, size) for provider in providers for size in sizes]
+
+        if (any(len(size) != 1 or not size.isascii() for size in sizes) or
+                any(len(provider) != 2 or not provider.isascii() for provider in providers) or
+                any(f"{size} {provider}" not in self.price_table for provider, size in codes)):
+            return None
+
+        size_lookup = np.full(128, -1, dtype=np.int64)
+        for i, size in enumerate(sizes):
+            size_lookup[ord(size)] = i
+
+        provider_lookup = np.full((128, 128), -1, dtype=np.int64)
+        for i, provider in enumerate(providers):
+            provider_lookup[ord(provider[0]), ord(provider[1])] = i
+
+        entries = [self.price_table[f"{size} {provider}"] for provider, size in codes]
+        base_prices = np.array([entry[2] for entry in entries])
+        static_discounts = np.array([entry[3] for entry in entries])
+        suffixes = [entry[5] for entry in entries] + [" Ignored"]
+
+        monthly_rules = []
+        for counter in self.monthly_counters:
+            applies = np.zeros(len(codes), dtype=bool)
+            amounts = np.zeros(len(codes))
+            nth, repeat = 0, False
+            for i, entry in enumerate(entries):
+                for _, rule_nth, rule_repeat, amount, rule_counter in entry[4]:
+                    if rule_counter == counter:
+                        applies[i] = True
+                        amounts[i] = amount
+                        nth, repeat = rule_nth, rule_repeat
+            if applies.any():
+                monthly_rules.append((counter, nth, repeat, applies, amounts))
+
+        stateful = static_discounts > 0
+        recordable = static_discounts > 0
+        for _, _, repeat, applies, _ in monthly_rules:
+            stateful |= applies
+            if repeat:
+                recordable |= applies
+
+        return {
+            'codes': codes,
+            'num_sizes': len(sizes),
+            'size_lookup': size_lookup,
+            'provider_lookup': provider_lookup,
+            'base_prices': base_prices,
+            'static_discounts': static_discounts,
+            'suffixes': np.array(suffixes, dtype=object),
+            'byte_suffixes': np.array([suffix.encode() for suffix in suffixes], dtype=object),
+            'monthly_rules': monthly_rules,
+            'entries': entries,
+            'stateful': stateful,
+            'recordable': recordable,
+        }
+
+    def get_batch_tables(self):
+        if not NUMPY_AVAILABLE:
+            return None
+        if self.batch_tables is None:
+            self.batch_tables = self._compile_batch_tables() or False
+        return self.batch_tables or None
+
+    def _parse_batch(self, lines, tables):
+        is_bytes = isinstance(lines[0], bytes)
+        if is_bytes:
+            def text_of(i):
+                return lines[i].decode('utf-8', 'surrogateescape').strip()
+
+            def finish(result):
+                return result.encode('utf-8', 'surrogateescape')
+        else:
+            def text_of(i):
+                return lines[i].strip()
+
+            def finish(result):
+                return result
+
+        n = len(lines)
+        lengths = np.fromiter(map(len, lines), dtype=np.int64, count=n)
+        if is_bytes:
+            rows = np.array(lines, dtype='S16').view(np.uint8).reshape(n, 16)
+        else:
+            rows = np.array(lines, dtype='U16').view(np.uint32).reshape(n, 16)
+
+        shape_ok = ((lengths == 15) | ((lengths == 16) & (rows[:, 15] == 10)))
+        shape_ok &= (rows[:, 10] == 32) & (rows[:, 12] == 32)
+        size_idx = tables['size_lookup'][np.minimum(rows[:, 11], 127)]
+        provider_idx = tables['provider_lookup'][np.minimum(rows[:, 13], 127), np.minimum(rows[:, 14], 127)]
+        ascii_ok = (rows[:, 11] < 128) & (rows[:, 13] < 128) & (rows[:, 14] < 128)
+        # Unsigned subtraction wraps anything below '0' past 9, so one comparison checks each digit
+        digits = rows[:, [0, 1, 2, 3, 5, 6, 8, 9]] - rows.dtype.type(48)
+        date_shape_ok = (digits <= 9).all(axis=1) & (rows[:, 4] == 45) & (rows[:, 7] == 45)
+        digits = digits.astype(np.int64)
+        regular = shape_ok & ascii_ok & date_shape_ok & (size_idx >= 0) & (provider_idx >= 0)
+        self.stage_timer.mark('parse')
+
+        year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        month = digits[:, 4] * 10 + digits[:, 5]
+        day = digits[:, 6] * 10 + digits[:, 7]
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        days_in_month = DAYS_IN_MONTH[np.clip(month, 0, 12)] + (leap & (month == 2))
+        date_ok = (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
+
+        codes = provider_idx * tables['num_sizes'] + size_idx
+        month_numbers = year * 12 + month - 1
+
+        return text_of, finish, regular, date_ok, codes, month_numbers
+
+    def process_batch(self, lines):
+        if not lines:
+            return []
+
+        is_bytes = isinstance(lines[0], bytes)
+        timer = self.stage_timer
+        tables = self.get_batch_tables()
+
+        if not tables:
+            process_line = self.process_transaction_bytes if is_bytes else self.process_transaction
+            results = [process_line(line) for line in lines]
+            timer.mark('price')
+            return results
+
+        n = len(lines)
+        text_of, finish, regular, date_ok, codes, month_numbers = self._parse_batch(lines, tables)
+        valid = regular & date_ok
+
+        irregular = ~regular
+        bad_dates = regular & ~date_ok
+        if self.quarantine is not None:
+            irregular |= bad_dates
+        elif bad_dates.any():
+            self.ignored_reasons['bad_date'] += int(bad_dates.sum())
+
+        irregular_results = self._parse_irregular_rows(tables, np.flatnonzero(irregular).tolist(), text_of, finish,
+                                                       month_numbers, codes, valid)
+        timer.mark('validate')
+
+        valid_idx = np.flatnonzero(valid)
+        valid_codes = codes[valid_idx]
+        final_prices, applied = self._price_rows(tables, month_numbers[valid_idx], valid_codes)
+        timer.mark('price')
+
+        line_applied = np.zeros(n)
+        line_applied[valid_idx] = applied
+
+        suffix_idx = np.full(n, len(tables['codes']), dtype=np.int64)
+        suffix_idx[valid_idx] = valid_codes
+        suffixes = tables['byte_suffixes' if is_bytes else 'suffixes'][suffix_idx].tolist()
+        results = [line[:15] + suffix for line, suffix in zip(lines, suffixes)]
+
+        for i, result in irregular_results.items():
+            results[i] = result
+
+        for i in np.flatnonzero(valid & ~regular & (line_applied == 0)).tolist():
+            results[i] = finish(text_of(i) + tables['suffixes'][suffix_idx[i]])
+
+        self._format_discounted_rows(results, valid_idx, final_prices, applied, text_of, finish)
+        timer.mark('format')
+
+        self.lines_processed += n
+        self.valid_lines += len(valid_idx)
+        self.ignored_lines += n - len(valid_idx)
+
+        return results
+
+    def summarize_batch(self, lines, summaries, saturation_threshold):
+        tables = self.get_batch_tables()
+        if not tables:
+            for line in lines:
+                self.summarize_line(line, summaries, saturation_threshold)
+            return
+
+        text_of, finish, regular, date_ok, codes, month_numbers = self._parse_batch(lines, tables)
+        valid = regular & date_ok
+        self._parse_irregular_rows(tables, np.flatnonzero(~regular).tolist(), text_of, finish,
+                                   month_numbers, codes, valid)
+
+        rows = np.flatnonzero(valid)
+        rows = rows[tables['stateful'][codes[rows]]]
+        if not len(rows):
+            return
+
+        row_months = month_numbers[rows]
+        order = np.argsort(row_months, kind='stable')
+        sorted_months = row_months[order]
+        sorted_codes = codes[rows[order]]
+        group_starts = np.flatnonzero(np.r_[True, sorted_months[1:] != sorted_months[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(sorted_months)])
+
+        month_summaries = []
+        for m in sorted_months[group_starts].tolist():
+            month_key = self.get_month_key(datetime(m // 12, m % 12 + 1, 1))
+            summary = summaries.get(month_key)
+            if summary is None:
+                summary = summaries[month_key] = MonthStateSummary(saturation_threshold)
+            month_summaries.append(summary)
+
+        # Only lines with a static discount or a repeating rule, and the first nth lines of
+        # each one-off rule, can be recorded; the rest only move the counters.
+        candidates = tables['recordable'][sorted_codes]
+        month_counts = []
+        for counter, nth, repeat, applies, _ in tables['monthly_rules']:
+            applied = applies[sorted_codes]
+            running = np.cumsum(applied)
+            totals = np.diff(np.r_[0, running[group_starts + group_sizes - 1]])
+            if not repeat:
+                counts_before = np.array([summary.counts.get(counter, 0) for summary in month_summaries])
+                group_offsets = counts_before - (running[group_starts] - applied[group_starts])
+                candidates |= applied & (running + np.repeat(group_offsets, group_sizes) <= nth)
+            month_counts.append((counter, totals.tolist()))
+
+        candidate_rows = np.flatnonzero(candidates)
+        bounds = np.searchsorted(candidate_rows, np.r_[group_starts, len(sorted_codes)]).tolist()
+        candidate_codes = sorted_codes[candidate_rows].tolist()
+        entries = tables['entries']
+
+        for i, summary in enumerate(month_summaries):
+            for code in candidate_codes[bounds[i]:bounds[i + 1]]:
+                if summary.guaranteed_discount >= saturation_threshold:
+                    break
+                size, provider, _, static_discount, monthly_rules, _ = entries[code]
+                summary.record(size, provider, static_discount, monthly_rules)
+
+        for counter, totals in month_counts:
+            for summary, count in zip(month_summaries, totals):
+                if count:
+                    summary.counts[counter] += count
+
+    def summarize_line(self, line, summaries, saturation_threshold):
+        matched = self.match_transaction_bytes(line)
+        if matched is None:
+            return
+
+        month_key, entry = matched
+        size, provider, _, static_discount, monthly_rules, _ = entry
+        if not monthly_rules and static_discount <= 0:
+            return
+
+        summary = summaries.get(month_key)
+        if summary is None:
+            summary = summaries[month_key] = MonthStateSummary(saturation_threshold)
+        summary.add(size, provider, static_discount, monthly_rules)
+
+    def process_compiled_rows(self, days, file_codes, pairs, exception_lines):
+        tables = self.get_batch_tables()
+        if not tables:
+            return self.process_batch(compiled_rows_to_lines(days, file_codes, pairs, exception_lines))
+
+        n = len(days)
+        code_map = np.full(256, -1, dtype=np.int64)
+        code_lookup = {code: i for i, code in enumerate(tables['codes'])}
+        for i, pair in enumerate(pairs):
+            size, provider = pair.decode().split(' ')
+            code_map[i] = code_lookup.get((provider, size), -1)
+
+        file_codes = file_codes.astype(np.int64)
+        codes = code_map[file_codes]
+        valid = codes >= 0
+        month_numbers = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + 1970 * 12
+
+        exception_rows = np.flatnonzero(file_codes == COMPILED_EXCEPTION_CODE)
+        exception_of = dict(zip(exception_rows.tolist(), exception_lines))
+        unique_days, day_idx = dense_unique(days, 65536)
+        day_strings = np.datetime_as_string(unique_days.astype('datetime64[D]')).tolist()
+
+        def text_of(i):
+            if i in exception_of:
+                return exception_of[i].decode('utf-8', 'surrogateescape').strip()
+            return f"{day_strings[day_idx[i]]} {pairs[file_codes[i]].decode()}"
+
+        def finish(result):
+            return result.encode('utf-8', 'surrogateescape')
+
+        irregular_results = self._parse_irregular_rows(tables, np.flatnonzero(~valid).tolist(), text_of, finish,
+                                                       month_numbers, codes, valid)
+
+        valid_idx = np.flatnonzero(valid)
+        valid_codes = codes[valid_idx]
+        final_prices, applied = self._price_rows(tables, month_numbers[valid_idx], valid_codes)
+
+        regular = valid & (file_codes != COMPILED_EXCEPTION_CODE)
+        unique_keys, key_idx = dense_unique(day_idx[regular] * 256 + file_codes[regular], len(unique_days) * 256)
+        lines = np.empty(len(unique_keys), dtype=object)
+        for j, key in enumerate(unique_keys.tolist()):
+            lines[j] = day_strings[key // 256].encode() + b' ' + pairs[key % 256] + tables['byte_suffixes'][code_map[key % 256]]
+
+        results = np.empty(n, dtype=object)
+        results[regular] = lines[key_idx]
+        results = results.tolist()
+
+        for i, result in irregular_results.items():
+            results[i] = result
+
+        for i in exception_rows[valid[exception_rows]].tolist():
+            results[i] = finish(text_of(i) + tables['suffixes'][codes[i]])
+
+        self._format_discounted_rows(results, valid_idx, final_prices, applied, text_of, finish)
+
+        self.lines_processed += n
+        self.valid_lines += len(valid_idx)
+        self.ignored_lines += n - len(valid_idx)
+
+        return results
+
+    def _parse_irregular_rows(self, tables, indices, text_of, finish, month_numbers, codes, valid):
+        irregular_results = {}
+        code_lookup = {code: i for i, code in enumerate(tables['codes'])}
+
+        for i in indices:
+            line = text_of(i)
+            if not line:
+                irregular_results[i] = finish("")
+                self.record_rejection('bad_field_count', line)
+                continue
+
+            parsed = self.parse_transaction(line)
+            if parsed is None:
+                irregular_results[i] = finish(f"{line} Ignored")
+                self.record_rejection(self.classify_rejection(line), line)
+                continue
+
+            date = parse_date(line.split()[0])
+            month_numbers[i] = date.year * 12 + date.month - 1
+            codes[i] = code_lookup[(parsed[2], parsed[1])]
+            valid[i] = True
+
+        return irregular_results
+
+    def _format_discounted_rows(self, results, valid_idx, final_prices, applied, text_of, finish):
+        for j in np.flatnonzero(applied != 0).tolist():
+            line = text_of(valid_idx[j])
+            if applied[j] > 0:
+                results[valid_idx[j]] = finish(f"{line} {final_prices[j]:.2f} {applied[j]:.2f}")
+            else:
+                results[valid_idx[j]] = finish(f"{line} {final_prices[j]:.2f} -")
+
+    def _price_rows(self, tables, month_numbers, valid_codes):
+        unique_months, month_idx = np.unique(month_numbers, return_inverse=True)
+        month_keys = [self.get_month_key(datetime(m // 12, m % 12 + 1, 1)) for m in unique_months.tolist()]
+
+        base_prices = tables['base_prices'][valid_codes]
+        discounts = tables['static_discounts'][valid_codes]
+
+        for counter, nth, repeat, applies, amounts in tables['monthly_rules']:
+            rule_idx = np.flatnonzero(applies[valid_codes])
+            if not len(rule_idx):
+                continue
+
+            monthly_counts = getattr(self, counter)
+            rule_months = month_idx[rule_idx]
+            order = np.argsort(rule_months, kind='stable')
+            sorted_months = rule_months[order]
+            group_starts = np.flatnonzero(np.r_[True, sorted_months[1:] != sorted_months[:-1]])
+            group_sizes = np.diff(np.r_[group_starts, len(sorted_months)])
+            initial_counts = np.array([monthly_counts.get(key, 0) for key in month_keys], dtype=np.int64)
+
+            positions = np.arange(len(sorted_months)) - np.repeat(group_starts, group_sizes)
+            counts = np.empty_like(positions)
+            counts[order] = initial_counts[sorted_months] + positions + 1
+
+            hits = counts == nth
+            if repeat:
+                hits |= counts % nth == 0
+            hit_idx = rule_idx[hits]
+            discounts[hit_idx] = discounts[hit_idx] + amounts[valid_codes[hit_idx]]
+
+            for m, total in zip(sorted_months[group_starts].tolist(), group_sizes.tolist()):
+                monthly_counts[month_keys[m]] += total
+
+        cap = self.monthly_discount_cap
+        used = [self.monthly_discounts[key] for key in month_keys]
+        saturated = np.array([u == cap for u in used], dtype=bool)
+        applied = np.zeros(len(valid_codes))
+
+        candidates = np.flatnonzero(discounts > 0)
+        candidates = candidates[~saturated[month_idx[candidates]]]
+        total_discount_applied = self.total_discount_applied
+
+        for i, m, discount in zip(candidates.tolist(), month_idx[candidates].tolist(),
+                                  discounts[candidates].tolist()):
+            applicable_discount = min(discount, cap - used[m])
+            used[m] += applicable_discount
+            total_discount_applied += applicable_discount
+            applied[i] = applicable_discount
+
+        self.total_discount_applied = total_discount_applied
+        for key, u in zip(month_keys, used):
+            self.monthly_discounts[key] = u
+
+        code_counts = np.bincount(valid_codes, minlength=len(tables['codes']))
+        for (provider, size), count in zip(tables['codes'], code_counts.tolist()):
+            if count:
+                self.provider_counts[provider] += count
+                self.size_counts[size] += count
+
+        return base_prices - applied, applied
+
+    def match_fixed_layout(self, body):
+        if len(body) != 15 or body[10] != 32:
+            return None
+
+        matched = self.byte_price_table.get(body[11:])
+        if matched is None:
+            return None
+
+        date = body[:10]
+        try:
+            month_key = self.month_key_cache[date]
+        except KeyError:
+            if not (date[:4].isdigit() and date[5:7].isdigit() and date[8:].isdigit() and
+                    date[4] == 45 and date[7] == 45):
+                return None
+
+            month_key = self.parse_month_key(date.decode())
+            if len(self.month_key_cache) >= DATE_CACHE_SIZE:
+                self.month_key_cache.clear()
+            self.month_key_cache[date] = month_key
+
+        return month_key, matched
+
+    def match_transaction_bytes(self, line):
+        matched = self.match_fixed_layout(line[:-1] if line.endswith(b'\n') else line)
+        if matched is not None:
+            month_key, (entry, _) = matched
+            return None if month_key is None else (month_key, entry)
+
+        parsed = self.parse_transaction(line.decode('utf-8', 'surrogateescape'))
+        if parsed is None:
+            return None
+
+        month_key, size, provider = parsed
+        return month_key, self.price_table[f"{size} {provider}"]
+
+    def process_transaction_bytes(self, line):
+        body = line[:15]
+        matched = self.byte_price_table.get(body[11:])
+        month_key = self.month_key_cache.get(body[:10], MISSING)
+
+        if (matched is None or month_key is MISSING or body[10] != 32 or
+                (len(line) != 15 and line[15:] != b'\n')):
+            body = line[:-1] if line.endswith(b'\n') else line
+            matched = self.match_fixed_layout(body)
+
+            if matched is None:
+                result = self.process_transaction(line.decode('utf-8', 'surrogateescape'))
+                return result.encode('utf-8', 'surrogateescape')
+
+            month_key, matched = matched
+
+        self.lines_processed += 1
+        entry, suffix = matched
+
+        if month_key is None:
+            self.ignored_lines += 1
+            self.record_rejection('bad_date', body.decode('utf-8', 'surrogateescape'))
+            return body + b" Ignored"
+
+        self.valid_lines += 1
+        base_price, discount, final_price = self.apply_price_entry(month_key, entry)
+
+        if discount == 0:
+            return body + suffix
+        elif discount > 0:
+            return b"%s %.2f %.2f" % (body, final_price, discount)
+        else:
+            return b"%s %.2f -" % (body, final_price)
+
+    def reject(self, line, reason):
+        self.ignored_lines += 1
+        self.ignored_reasons[reason] += 1
+        if self.quarantine is not None:
+            self.quarantine.append((reason, line))
+        return f"{line} Ignored"
+
+    def record_rejection(self, reason, line):
+        self.ignored_reasons[reason] += 1
+        if self.quarantine is not None:
+            self.quarantine.append((reason, line))
+
+    def classify_fields(self, size, provider):
+        if size not in self.valid_sizes:
+            return 'unknown_size'
+        if provider not in self.valid_providers:
+            return 'unknown_provider'
+        if f"{size} {provider}" not in self.price_table:
+            return 'unknown_size'
+        return 'bad_date'
+
+    def classify_rejection(self, line):
+        parts = line.split()
+        if len(parts) != 3:
+            return 'bad_field_count'
+        return self.classify_fields(parts[1], parts[2])
+
+    def parse_transaction(self, line):
+        parts = line.split()
+
+        if len(parts) != 3:
+            return None
+
+        date_str, size, provider = parts
+
+        if provider not in self.valid_providers or size not in self.valid_sizes:
+            return None
+
+        month_key = self.parse_month_key(date_str)
+        if month_key is None:
+            return None
+
+        return month_key, size, provider
+
+    def get_saturation_threshold(self):
+        max_discount = max(
+            entry[3] + sum(amount for _, _, _, amount, _ in entry[4])
+            for entry in self.price_table.values()
+        )
+        return self.monthly_discount_cap + max_discount
+
+    def get_monthly_state(self, months=None):
+        names = ['monthly_discounts'] + self.monthly_counters
+
+        if months is None:
+            months = set()
+            for name in names:
+                months.update(getattr(self, name))
+
+        return {name: {month: getattr(self, name)[month] for month in months} for name in names}
+
+    def load_monthly_state(self, state):
+        for name, values in state.items():
+            getattr(self, name).update(values)
+
+    def replay_month(self, month_key, summary):
+        counts_before = {counter: getattr(self, counter)[month_key] for counter in summary.counts}
+
+        for size, provider in summary.events:
+            self.calculate_month_discount(month_key, size, provider)
+
+        for counter, count in summary.counts.items():
+            getattr(self, counter)[month_key] = counts_before[counter] + count
+
     def print_statistics(self, run_stats):
         elapsed_time_str = run_stats.format_elapsed_time()
 
@@ -252,6 +1085,9 @@ class ShippingCalculator:
         self._print_stat_line(BOX_V, "Lines processed:", f"{self.lines_processed:,}", box_width, CYAN, YELLOW, END)
         self._print_stat_line(BOX_V, "Valid transactions:", f"{self.valid_lines:,}", box_width, CYAN, GREEN, END)
         self._print_stat_line(BOX_V, "Ignored lines:", f"{self.ignored_lines:,}", box_width, CYAN, RED, END)
+        for reason, label in REJECT_REASONS.items():
+            if self.ignored_reasons.get(reason):
+                self._print_stat_line(BOX_V, f"  {label}:", f"{self.ignored_reasons[reason]:,}", box_width, CYAN, RED, END)
         self._print_stat_line(BOX_V, "Total discount:", f"€{self.total_discount_applied:.2f}", box_width, CYAN, GREEN, END)
 
         if PSUTIL_AVAILABLE:
@@ -259,6 +1095,20 @@ class ShippingCalculator:
             memory_mb = process.memory_info().rss / (1024 * 1024)
             self._print_stat_line(BOX_V, "Memory usage:", f"{memory_mb:.2f} MB", box_width, CYAN, BLUE, END)
 
+        if self.tuning:
+            tuning = self.tuning
+            memory = f"~{tuning['worker_memory_mb']:.0f} MB"
+            if tuning['memory_limit_mb']:
+                memory += f" (limit {tuning['memory_limit_mb']:,.0f} MB)"
+
+            print(f"{CYAN}{BOX_V}{END}{' ' * box_width}{CYAN}{BOX_V}{END}")
+            self._print_stat_line(BOX_V, "Auto-tuning:", "", box_width, CYAN, MAGENTA, END)
+            self._print_stat_line(BOX_V, "   Processes:", f"{tuning['processes']} of {tuning['cpus']} (limited by {tuning['limited_by']})", box_width, CYAN, BLUE, END)
+            self._print_stat_line(BOX_V, "   Batch size:", f"{tuning['batch_lines']:,} lines", box_width, CYAN, BLUE, END)
+            self._print_stat_line(BOX_V, "   Core speed:", f"{tuning['core_lines_per_second']:,.0f} lines/s", box_width, CYAN, BLUE, END)
+            self._print_stat_line(BOX_V, "   Read speed:", f"{tuning['io_mb_per_second']:,.1f} MB/s", box_width, CYAN, BLUE, END)
+            self._print_stat_line(BOX_V, "   Worker memory:", memory, box_width, CYAN, BLUE, END)
+
         print(f"{CYAN}{BOX_V}{END}{' ' * box_width}{CYAN}{BOX_V}{END}")
         self._print_stat_line(BOX_V, "Provider statistics:", "", box_width, CYAN, MAGENTA, END)
         
@@ -283,241 +1133,2181 @@ class ShippingCalculator:
             return 80
 
 
-def count_lines_in_file(file_path):
+def get_file_size(file_path):
 
     try:
-        with open(file_path, 'r') as f:
-            line_count = sum(1 for _ in f)
-        return line_count
+        return os.path.getsize(file_path)
     except FileNotFoundError:
         print(f"Error: File '{file_path}' not found.")
         sys.exit(1)
     except Exception as e:
-        print(f"Error counting lines: {str(e)}")
+        print(f"Error reading file size: {str(e)}")
         return 0
 
 
-def read_chunk_from_file(file_path, start_line, end_line):
-    chunk = []
-    with open(file_path, 'r') as f:
-        for _ in range(start_line):
-            next(f)
+def compute_chunk_boundaries(file_path, file_size, num_chunks, start_offset=0):
+    chunk_boundaries = []
+    first_offset = start_offset
 
-        for _ in range(end_line - start_line):
-            try:
-                line = next(f)
-                chunk.append(line)
-            except StopIteration:
-                break
-                
-    return chunk
+    with open(file_path, 'rb') as f:
+        for i in range(1, num_chunks):
+            target = first_offset + (file_size - first_offset) * i // num_chunks
+            if target <= start_offset:
+                continue
 
+            f.seek(target - 1)
+            f.readline()
+            end_offset = f.tell()
 
-def process_chunk(args):
-    global terminate_flag
-    file_path, start_line, end_line, worker_id, progress_dict, progress_dict_lock = args
+            if end_offset > start_offset:
+                chunk_boundaries.append((start_offset, end_offset))
+                start_offset = end_offset
 
-    calculator = ShippingCalculator()
-    chunk = read_chunk_from_file(file_path, start_line, end_line)
-    results = []
-    lines_processed = 0
-    
-    for line in chunk:
-        if terminate_flag:
-            break
-            
-        result = calculator.process_transaction(line)
-        if result:
-            results.append(result)
-        
-        lines_processed += 1
+    if start_offset < file_size:
+        chunk_boundaries.append((start_offset, file_size))
 
-        if lines_processed % 1000 == 0 or lines_processed == len(chunk):
-            with progress_dict_lock:
-                progress_dict[worker_id] = lines_processed
-    
-    with progress_dict_lock:
-        progress_dict[worker_id] = lines_processed
-    
-    return {
-        'results': results,
-        'lines_processed': calculator.lines_processed,
-        'valid_lines': calculator.valid_lines,
-        'ignored_lines': calculator.ignored_lines,
-        'total_discount_applied': calculator.total_discount_applied,
-        'monthly_lp_l_count': dict(calculator.monthly_lp_l_count),
-        'monthly_discounts': dict(calculator.monthly_discounts),
-        'provider_counts': dict(calculator.provider_counts),
-        'size_counts': dict(calculator.size_counts),
-        'chunk_size': len(chunk),
-        'start_line': start_line,
-        'end_line': end_line
+    return chunk_boundaries
+
+
+def find_last_line_end(file_path, start_offset, file_size):
+    if file_size <= start_offset:
+        return start_offset
+
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            newline = mm.rfind(b'\n', start_offset, file_size)
+
+    return start_offset if newline < 0 else newline + 1
+
+
+def file_fingerprint(file_path, offset):
+    start = max(0, offset - CHECKPOINT_FINGERPRINT_BYTES)
+
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+def load_checkpoint(checkpoint_file, input_file, calculator):
+    with open(checkpoint_file, 'r') as f:
+        checkpoint = json.load(f)
+
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {checkpoint.get('version')}")
+
+    if sorted(checkpoint['monthly_state']) != sorted(['monthly_discounts'] + calculator.monthly_counters):
+        raise ValueError("Checkpoint was written with different discount rules")
+
+    offset = checkpoint['offset']
+    if offset > get_file_size(input_file) or file_fingerprint(input_file, offset) != checkpoint['fingerprint']:
+        raise ValueError(f"Input file '{input_file}' does not start with the data recorded in the checkpoint")
+
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_file, input_file, offset, monthly_state, output_size, quarantine_size=None):
+    checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'input_file': os.path.abspath(input_file),
+        'offset': offset,
+        'fingerprint': file_fingerprint(input_file, offset),
+        'output_size': output_size,
+        'quarantine_size': quarantine_size,
+        'monthly_state': monthly_state
     }
 
+    temp_path = f"{checkpoint_file}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, checkpoint_file)
 
-def process_file_parallel(input_file, output_file=None, num_processes=None):
-    global terminate_flag
-    run_stats = RunStats()
-    run_stats.start()
-    
-    if num_processes is None:
-        num_processes = min(4, mp.cpu_count())
 
-    GREEN = '\033[32m'
-    YELLOW = '\033[33m'
-    BLUE = '\033[34m'
-    MAGENTA = '\033[35m'
-    CYAN = '\033[36m'
-    BOLD = '\033[1m'
-    END = '\033[0m'
-    
-    print(f"\n{BOLD}{CYAN}Analyzing file:{END} {YELLOW}{input_file}{END}")
-    print(f"{BOLD}{BLUE}Using {num_processes} parallel processes{END}")
-    
-    print(f"{BOLD}{MAGENTA}Counting lines in file...{END}")
-    total_lines = count_lines_in_file(input_file)
-    print(f"{BOLD}{GREEN}Found {total_lines:,} lines to process{END}")
-    
-    progress = SimpleProgressBar(total_lines, prefix='Processing')
-    
-    print(f"{BOLD}{MAGENTA}Dividing file into chunks...{END}")
-    chunk_size = total_lines // num_processes
-    remainder = total_lines % num_processes
+def detect_compression(file_path):
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+
+    if magic[:2] == b'\x1f\x8b':
+        return 'gzip'
+    if magic[:3] == b'BZh':
+        return 'bz2'
+    if magic == b'\x28\xb5\x2f\xfd':
+        return 'zstd'
+    return None
+
+
+def index_compressed_members(file_path, compression, file_size):
+    if compression == 'gzip':
+        return index_bgzf_blocks(file_path, file_size)
+    if compression == 'bz2':
+        return index_bz2_streams(file_path, file_size)
+    return None
+
+
+def index_bgzf_blocks(file_path, file_size):
+    offsets = []
+    offset = 0
+
+    with open(file_path, 'rb') as f:
+        while offset < file_size:
+            f.seek(offset)
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+                return None
+
+            extra_length = struct.unpack('<H', header[10:12])[0]
+            extra = f.read(extra_length)
+            block_size = None
+            position = 0
+            while position + 4 <= len(extra):
+                subfield_length = struct.unpack('<H', extra[position + 2:position + 4])[0]
+                if extra[position:position + 2] == b'BC' and subfield_length == 2:
+                    block_size = struct.unpack('<H', extra[position + 4:position + 6])[0] + 1
+                position += 4 + subfield_length
+
+            if block_size is None:
+                return None
+
+            offsets.append(offset)
+            offset += block_size
 
+    return offsets if offset == file_size else None
+
+
+def index_bz2_streams(file_path, file_size):
+    offsets = []
+
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            position = mm.find(b'BZh')
+            while 0 <= position <= file_size - 10:
+                if mm[position + 3:position + 4].isdigit() and mm[position + 4:position + 10] == BZ2_STREAM_MAGIC:
+                    offsets.append(position)
+                position = mm.find(b'BZh', position + 1)
+
+    return offsets if offsets and offsets[0] == 0 else None
+
+
+def compute_member_chunk_boundaries(member_offsets, file_size, num_chunks):
     chunk_boundaries = []
-    start_line = 0
-    
-    for i in range(num_processes):
-        this_chunk_size = chunk_size + (1 if i < remainder else 0)
-        end_line = start_line + this_chunk_size
-        chunk_boundaries.append((start_line, end_line))
-        start_line = end_line
-    
-    GREEN = '\033[32m'
-    BOLD = '\033[1m'
-    END = '\033[0m'
-    print(f"{BOLD}{GREEN}Created {num_processes} chunks of approximately {chunk_size:,} lines each{END}")
-    
-    manager = mp.Manager()
-    progress_dict = manager.dict()
-    progress_dict_lock = manager.Lock()
-    
-    for i in range(num_processes):
-        progress_dict[i] = 0
-        
-    all_results = []
-    calculator = ShippingCalculator()
-    args = [(input_file, chunk_boundaries[i][0], chunk_boundaries[i][1], i, progress_dict, progress_dict_lock) 
-            for i in range(num_processes)]
-    
-    def update_progress_thread():
-        global terminate_flag
-        total_processed = 0
-        while total_processed < total_lines and not terminate_flag:
-            with progress_dict_lock:
-                total_processed = sum(progress_dict.values())
+    start_offset = 0
 
-            progress.update(min(total_processed, total_lines))
-            
-            if total_processed >= total_lines * 0.99:
-                break
+    for i in range(1, num_chunks):
+        index = bisect.bisect_left(member_offsets, file_size * i // num_chunks)
+        if index < len(member_offsets) and member_offsets[index] > start_offset:
+            chunk_boundaries.append((start_offset, member_offsets[index]))
+            start_offset = member_offsets[index]
 
-            time.sleep(0.1)
-    
-    update_thread = threading.Thread(target=update_progress_thread)
-    update_thread.daemon = True
-    update_thread.start()
+    chunk_boundaries.append((start_offset, file_size))
+    return chunk_boundaries
 
-    pool = None
-    results = []
-    
-    try:
-        pool = mp.Pool(processes=num_processes)
-        result_iter = pool.imap_unordered(process_chunk, args)
-        
-        while True:
-            try:
-                if terminate_flag:
-                    if pool:
-                        pool.terminate()
-                        pool.join()
-                    print("\nProcess terminated by user.")
-                    return None
 
-                result = next(result_iter)
-                
-                if output_file is None:
-                    all_results.extend(result['results'][:1000] if len(all_results) < 1000 else [])
+def new_decompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(31)
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    raise ValueError(f"Compression format '{compression}' cannot be split into members")
 
-                calculator.lines_processed += result['lines_processed']
-                calculator.valid_lines += result['valid_lines']
-                calculator.ignored_lines += result['ignored_lines']
-                calculator.total_discount_applied += result['total_discount_applied']
 
-                for month, count in result['monthly_lp_l_count'].items():
-                    calculator.monthly_lp_l_count[month] += count
-                
-                for month, discount in result['monthly_discounts'].items():
-                    calculator.monthly_discounts[month] += discount
-                
-                for provider, count in result['provider_counts'].items():
-                    calculator.provider_counts[provider] += count
-                    
-                for size, count in result['size_counts'].items():
-                    calculator.size_counts[size] += count
-          
-                results.append(result['results'])
-                
-            except StopIteration:
-                break
-            except Exception as e:
-                if not terminate_flag:
-                    print(f"Error processing results: {str(e)}")
+def read_compressed_members(file_path, compression, start_offset):
+    with open(file_path, 'rb') as f:
+        f.seek(start_offset)
+        member_start = start_offset
+        decompressor = new_decompressor(compression)
+
+        while True:
+            data = f.read(COMPRESSED_READ_SIZE)
+            if not data:
                 break
+            data_end = f.tell()
+
+            while data:
+                block = decompressor.decompress(data)
+                if block:
+                    yield member_start, block
+
+                if not decompressor.eof:
+                    break
+
+                data = decompressor.unused_data
+                member_start = data_end - len(data)
+                decompressor = new_decompressor(compression)
+
+
+def read_compressed_chunk(file_path, compression, start_offset, end_offset, worker_id=None):
+    pending = b''
+    skip_partial_line = start_offset > 0
+
+    for member_start, block in read_compressed_members(file_path, compression, start_offset):
+        if member_start >= end_offset:
+            newline = block.find(b'\n')
+            if skip_partial_line:
+                return
+            if newline < 0:
+                pending += block
+                continue
+            yield pending + block[:newline + 1]
+            return
 
-        if pool:
-            pool.close()
-            pool.join()
-            
-        if terminate_flag:
-            return None
+        if worker_id is not None and worker_progress is not None:
+            worker_progress[worker_id] = member_start - start_offset
 
-        progress.update(total_lines)
+        if skip_partial_line:
+            newline = block.find(b'\n')
+            if newline < 0:
+                continue
+            block = block[newline + 1:]
+            skip_partial_line = False
 
-        if output_file:
-            with open(output_file, 'w') as f:
-                for chunk_results in results:
-                    for result in chunk_results:
-                        f.write(result + '\n')
+        lines = block.split(b'\n')
+        lines[0] = pending + lines[0]
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
 
-        run_stats.end()
-        calculator.print_statistics(run_stats)
-        
-        print()
+    if pending and not skip_partial_line:
+        yield pending
+
+
+def open_decompressed(raw, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(raw, 'rb')
+    if compression == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise ValueError("Reading zstd input requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=False)
+    return raw
+
+
+def dense_unique(values, size):
+    present = np.zeros(size, dtype=bool)
+    present[values] = True
+    rank = np.cumsum(present) - 1
+    return np.flatnonzero(present), rank[values]
+
+
+def is_compiled_file(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+
+
+def compiled_day_number(calculator, date_bytes):
+    if not (date_bytes[:4].isdigit() and date_bytes[5:7].isdigit() and date_bytes[8:].isdigit() and
+            date_bytes[4] == 45 and date_bytes[7] == 45):
+        return None
+
+    day = parse_date(date_bytes.decode())
+    if day is None:
+        return None
+
+    day_number = (day - COMPILED_EPOCH).days
+    if not 0 <= day_number < 65536:
+        return None
+
+    return day_number, calculator.get_month_key(day)
+
+
+def compile_input_file(input_file, compiled_file):
+    calculator = ShippingCalculator()
+    pairs = sorted(calculator.price_table)
+    if len(pairs) >= COMPILED_EXCEPTION_CODE:
+        raise ValueError("Too many size/provider pairs for the compiled format")
+
+    code_of = {pair.encode(): i for i, pair in enumerate(pairs)}
+    day_cache = {}
+    months = {}
+    rows = 0
+    exception_count = 0
+    exception_size = 0
+
+    section_names = ['days', 'codes', 'exception_offsets', 'exception_data']
+    part_dir = tempfile.mkdtemp(prefix='.shipping_compile_', dir=os.path.dirname(os.path.abspath(compiled_file)))
+    parts = {name: open(os.path.join(part_dir, name), 'wb') for name in section_names}
+
+    days = array('H')
+    codes = array('B')
+    exception_offsets = array('Q', [0])
+
+    def flush_columns():
+        for column, name in ((days, 'days'), (codes, 'codes'), (exception_offsets, 'exception_offsets')):
+            if sys.byteorder == 'big':
+                column.byteswap()
+            column.tofile(parts[name])
+            del column[:]
+
+    try:
+        for line in read_chunk_from_file(input_file, 0, get_file_size(input_file)):
+            body = line[:-1] if line.endswith(b'\n') else line
+            code = code_of.get(body[11:]) if len(body) == 15 and body[10] == 32 else None
+
+            day = None
+            if code is not None:
+                day = day_cache.get(body[:10], MISSING)
+                if day is MISSING:
+                    if len(day_cache) >= DATE_CACHE_SIZE:
+                        day_cache.clear()
+                    day = day_cache[body[:10]] = compiled_day_number(calculator, body[:10])
+
+            if day is None:
+                parts['exception_data'].write(body)
+                exception_size += len(body)
+                exception_count += 1
+                exception_offsets.append(exception_size)
+                days.append(0)
+                codes.append(COMPILED_EXCEPTION_CODE)
+
+                parsed = calculator.parse_transaction(body.decode('utf-8', 'surrogateescape').strip())
+                month_key = parsed[0] if parsed else None
+            else:
+                day_number, month_key = day
+                days.append(day_number)
+                codes.append(code)
+
+            if month_key is not None:
+                month = months.get(month_key)
+                if month is None:
+                    months[month_key] = [1, rows, rows]
+                else:
+                    month[0] += 1
+                    month[2] = rows
+
+            rows += 1
+            if len(days) >= COMPILED_BATCH_ROWS:
+                flush_columns()
+
+        flush_columns()
+        for part in parts.values():
+            part.close()
+
+        sections = {}
+        with open(compiled_file, 'wb') as output:
+            output.write(COMPILED_MAGIC)
+            for name in section_names:
+                output.write(b'\0' * (-output.tell() % 8))
+                size = os.path.getsize(os.path.join(part_dir, name))
+                sections[name] = [output.tell(), size]
+                output.flush()
+                append_file(output, os.path.join(part_dir, name))
+                output.seek(0, os.SEEK_END)
+
+            footer = json.dumps({
+                'version': COMPILED_VERSION,
+                'rows': rows,
+                'exceptions': exception_count,
+                'pairs': pairs,
+                'epoch': COMPILED_EPOCH.isoformat(),
+                'sections': sections,
+                'months': dict(sorted(months.items()))
+            }).encode()
+            output.write(footer)
+            output.write(struct.pack('<Q', len(footer)) + COMPILED_MAGIC)
+
+    finally:
+        for part in parts.values():
+            part.close()
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    return rows
+
+
+def read_compiled_footer(mm):
+    if mm[:len(COMPILED_MAGIC)] != COMPILED_MAGIC or mm[-len(COMPILED_MAGIC):] != COMPILED_MAGIC:
+        raise ValueError("Not a compiled shipping transactions file")
+
+    footer_size = struct.unpack('<Q', mm[-len(COMPILED_MAGIC) - 8:-len(COMPILED_MAGIC)])[0]
+    footer_end = len(mm) - len(COMPILED_MAGIC) - 8
+    footer = json.loads(mm[footer_end - footer_size:footer_end])
+
+    if footer.get('version') != COMPILED_VERSION:
+        raise ValueError(f"Unsupported compiled file version: {footer.get('version')}")
+
+    return footer
+
+
+def read_compiled_exception_offsets(mm, sections):
+    exception_start, exception_size = sections['exception_offsets']
+    exception_offsets = array('Q')
+    exception_offsets.frombytes(mm[exception_start:exception_start + exception_size])
+    if sys.byteorder == 'big':
+        exception_offsets.byteswap()
+    return exception_offsets
+
+
+def read_compiled_rows(mm, sections, exception_offsets, start, end, exception_index):
+    days_start = sections['days'][0]
+    codes_start = sections['codes'][0]
+    exception_data = sections['exception_data'][0]
+
+    codes = mm[codes_start + start:codes_start + end]
+    if NUMPY_AVAILABLE:
+        days = np.frombuffer(mm[days_start + start * 2:days_start + end * 2], dtype='<u2')
+        codes = np.frombuffer(codes, dtype=np.uint8)
+        exception_count = int((codes == COMPILED_EXCEPTION_CODE).sum())
+    else:
+        days = array('H')
+        days.frombytes(mm[days_start + start * 2:days_start + end * 2])
+        if sys.byteorder == 'big':
+            days.byteswap()
+        exception_count = codes.count(COMPILED_EXCEPTION_CODE)
+
+    exception_lines = [mm[exception_data + exception_offsets[k]:exception_data + exception_offsets[k + 1]]
+                       for k in range(exception_index, exception_index + exception_count)]
+    return days, codes, exception_lines, exception_index + exception_count
+
+
+def compiled_rows_to_lines(days, codes, pairs, exception_lines):
+    exceptions = iter(exception_lines)
+    day_strings = {}
+    lines = []
+
+    for day, code in zip(days, codes):
+        if code == COMPILED_EXCEPTION_CODE:
+            lines.append(next(exceptions))
+            continue
+
+        day_string = day_strings.get(day)
+        if day_string is None:
+            day_string = day_strings[day] = (COMPILED_EPOCH + timedelta(days=int(day))).isoformat().encode()
+        lines.append(day_string + b' ' + pairs[code])
+
+    return lines
+
+
+def read_chunk_from_file(file_path, start_offset, end_offset):
+    if end_offset <= start_offset:
+        return
+
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL, start_offset - start_offset % mmap.PAGESIZE,
+                           end_offset - start_offset + start_offset % mmap.PAGESIZE)
+
+            mm.seek(start_offset)
+            readline = mm.readline
+
+            while mm.tell() < end_offset:
+                line = readline()
+                if not line:
+                    break
+                yield line
+
+
+def read_chunk_batches(file_path, start_offset, end_offset, compression=None, worker_id=None,
+                       batch_lines=OUTPUT_BATCH_LINES):
+    if compression:
+        lines = read_compressed_chunk(file_path, compression, start_offset, end_offset, worker_id)
+        for batch in iter(lambda: list(islice(lines, batch_lines)), []):
+            yield batch, sum(map(len, batch))
+        return
+
+    if end_offset <= start_offset:
+        return
+
+    block_size = batch_lines * BATCH_LINE_BYTES
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL, start_offset - start_offset % mmap.PAGESIZE,
+                           end_offset - start_offset + start_offset % mmap.PAGESIZE)
+
+            offset = start_offset
+            while offset < end_offset:
+                block_end = min(offset + block_size, end_offset)
+                if block_end < end_offset:
+                    newline = mm.rfind(b'\n', offset, block_end)
+                    if newline < 0:
+                        newline = mm.find(b'\n', block_end, end_offset)
+                    block_end = end_offset if newline < 0 else newline + 1
+
+                batch = mm[offset:block_end].split(b'\n')
+                if not batch[-1]:
+                    batch.pop()
+                yield batch, block_end - offset
+                offset = block_end
+
+
+def summarize_chunk(args):
+    file_path, start_offset, end_offset, compression, worker_id = args
+
+    def tracked_batches():
+        bytes_read = 0
+        for batch, nbytes in read_chunk_batches(file_path, start_offset, end_offset, compression, worker_id,
+                                                worker_batch_lines):
+            yield batch
+            bytes_read += nbytes
+            if worker_progress is not None and not compression:
+                worker_progress[worker_id] = bytes_read
+
+    summaries = summarize_batches(tracked_batches())
+    if worker_progress is not None:
+        worker_progress[worker_id] = end_offset - start_offset
+    return summaries
+
+
+def summarize_chunk_timed(args):
+    timer = StageTimer()
+    summaries = summarize_chunk(args)
+    timer.mark('summarize', args[2] - args[1])
+    timer.mark('summary_pickle', len(pickle.dumps(summaries)))
+    return summaries, os.getpid(), timer.stages
+
+
+def summarize_block(block):
+    return summarize_lines(block.split(b'\n'))
+
+
+def summarize_lines(lines):
+    lines = iter(lines)
+    return summarize_batches(iter(lambda: list(islice(lines, worker_batch_lines)), []))
+
+
+def summarize_batches(batches):
+    global terminate_flag
+    calculator = ShippingCalculator()
+    saturation_threshold = calculator.get_saturation_threshold()
+    summaries = {}
+
+    for batch in batches:
+        if terminate_flag:
+            break
+        calculator.summarize_batch(batch, summaries, saturation_threshold)
+
+    return summaries
+
+
+def index_chunk(args):
+    global terminate_flag
+    file_path, start_offset, end_offset = args
+
+    calculator = ShippingCalculator()
+    blocks = []
+    block_start = start_offset
+    offset = start_offset
+    months = set()
+
+    for line in read_chunk_from_file(file_path, start_offset, end_offset):
+        if terminate_flag:
+            break
+
+        if offset - block_start >= MONTH_INDEX_BLOCK_SIZE:
+            blocks.append((block_start, offset, sorted(months)))
+            block_start = offset
+            months = set()
+
+        matched = calculator.match_transaction_bytes(line)
+        if matched is not None:
+            months.add(matched[0])
+        offset += len(line)
+
+    if offset > block_start:
+        blocks.append((block_start, offset, sorted(months)))
+
+    return blocks
+
+
+def build_month_index(input_file, num_processes=None, profile_dir=None):
+    if num_processes is None or num_processes == 'auto':
+        num_processes = min(4, mp.cpu_count())
+
+    file_size = get_file_size(input_file)
+    chunk_boundaries = compute_chunk_boundaries(input_file, file_size, num_processes * 4)
+
+    index_args = [(input_file, start, end) for start, end in chunk_boundaries]
+    with mp.Pool(processes=num_processes, initializer=init_worker,
+                 initargs=(None, OUTPUT_BATCH_LINES, False, profile_dir)) as pool:
+        if profile_dir:
+            chunk_blocks = pool.map(profiled_call, [(index_chunk, args) for args in index_args])
+        else:
+            chunk_blocks = pool.map(index_chunk, index_args)
+
+    months = {}
+    for blocks in chunk_blocks:
+        for block_start, block_end, block_months in blocks:
+            for month_key in block_months:
+                ranges = months.setdefault(month_key, [])
+                if ranges and ranges[-1][1] == block_start:
+                    ranges[-1][1] = block_end
+                else:
+                    ranges.append([block_start, block_end])
+
+    return {
+        'version': MONTH_INDEX_VERSION,
+        'input_file': os.path.abspath(input_file),
+        'file_size': file_size,
+        'fingerprint': file_fingerprint(input_file, file_size),
+        'block_size': MONTH_INDEX_BLOCK_SIZE,
+        'months': dict(sorted(months.items()))
+    }
+
+
+def save_month_index(index_file, index):
+    temp_path = f"{index_file}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_path, index_file)
+
+
+def load_month_index(index_file, input_file):
+    try:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (index.get('version') != MONTH_INDEX_VERSION or index.get('file_size') != get_file_size(input_file) or
+            index.get('fingerprint') != file_fingerprint(input_file, index['file_size'])):
+        return None
+
+    return index
+
+
+def advance_monthly_state(calculator, summaries):
+    initial_state = calculator.get_monthly_state(summaries)
+
+    for month_key, summary in summaries.items():
+        calculator.replay_month(month_key, summary)
+
+    return initial_state
+
+
+def count_tasks(total_bytes, num_processes):
+    return max(num_processes * MIN_TASKS_PER_PROCESS, -(-total_bytes // TASK_CHUNK_BYTES))
+
+
+def parse_memory_size(value):
+    units = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+    text = value.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+
+    multiplier = 1
+    if text and text[-1] in units:
+        multiplier = units[text[-1]]
+        text = text[:-1]
+
+    size_mb = float(text) * multiplier
+    if size_mb <= 0:
+        raise ValueError(f"Memory size must be positive, got '{value}'")
+    return size_mb
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return mp.cpu_count()
+
+
+def current_memory_mb():
+    if PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    return AUTO_TUNE_DEFAULT_WORKER_MB
+
+
+def auto_tune_sample_bytes(total_bytes):
+    return min(AUTO_TUNE_SAMPLE_BYTES, max(total_bytes // 8, AUTO_TUNE_MIN_SAMPLE_BYTES))
+
+
+def sample_input(file_path, start_offset=0, compression=None, sample_bytes=AUTO_TUNE_SAMPLE_BYTES):
+    with open(file_path, 'rb') as f:
+        f.seek(start_offset)
+        read_start = time.perf_counter()
+        data = f.read(sample_bytes)
+        read_seconds = time.perf_counter() - read_start
+        raw_bytes = len(data)
+        decode_seconds = 0.0
+
+        if compression:
+            f.seek(start_offset)
+            decode_start = time.perf_counter()
+            data = open_decompressed(f, compression).read(sample_bytes)
+            decode_seconds = time.perf_counter() - decode_start
+            raw_bytes = f.tell() - start_offset
+
+    lines = data[:data.rfind(b'\n') + 1].split(b'\n')
+    lines.pop()
+    return lines, raw_bytes, read_seconds, decode_seconds
+
+
+def auto_tune(file_path, total_bytes, start_offset=0, compression=None, single_stream=False,
+              memory_limit_mb=None, max_processes=None):
+    cpus = max_processes or available_cpus()
+    sample_bytes = auto_tune_sample_bytes(total_bytes)
+    lines, raw_bytes, read_seconds, decode_seconds = sample_input(file_path, start_offset, compression, sample_bytes)
+
+    tuning = {
+        'processes': 1,
+        'batch_lines': OUTPUT_BATCH_LINES,
+        'cpus': cpus,
+        'limited_by': 'file size',
+        'core_lines_per_second': 0.0,
+        'io_mb_per_second': raw_bytes / max(read_seconds, 1e-6) / (1024 * 1024),
+        'worker_memory_mb': current_memory_mb(),
+        'memory_limit_mb': memory_limit_mb
+    }
+    if not lines:
+        return tuning
+
+    ShippingCalculator().process_batch(lines[:AUTO_TUNE_BATCH_SIZES[0]])
+
+    file_tasks = max(1, -(-total_bytes // TASK_CHUNK_BYTES))
+    if file_tasks == 1 and not memory_limit_mb:
+        batch_start = time.perf_counter()
+        ShippingCalculator().process_batch(lines[:OUTPUT_BATCH_LINES])
+        tuning['core_lines_per_second'] = min(len(lines), OUTPUT_BATCH_LINES) / max(time.perf_counter() - batch_start, 1e-6)
+        return tuning
+
+    # Every candidate batch size is timed on the same subset of the sample, just large enough
+    # for one batch of the largest size, and the times are scaled up to the whole sample.
+    timed_lines = lines[:AUTO_TUNE_BATCH_SIZES[-1]]
+    scale = len(lines) / len(timed_lines)
+
+    timings = {}
+    for batch_lines in AUTO_TUNE_BATCH_SIZES:
+        calculator = ShippingCalculator()
+        batch_start = time.perf_counter()
+        for i in range(0, len(timed_lines), batch_lines):
+            calculator.process_batch(timed_lines[i:i + batch_lines])
+        timings[batch_lines] = (time.perf_counter() - batch_start) * scale
+
+    fastest = min(timings.values())
+    batch_lines = min(size for size, seconds in timings.items() if seconds <= fastest * 1.05)
+
+    summarize_start = time.perf_counter()
+    summarize_lines(timed_lines)
+    summarize_seconds = (time.perf_counter() - summarize_start) * scale
+
+    tracemalloc.start()
+    ShippingCalculator().process_batch(lines[:batch_lines])
+    batch_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    line_mb = batch_peak / min(batch_lines, len(lines)) / (1024 * 1024)
+
+    decode_passes = 0 if single_stream else 2
+    core_seconds = max(decode_passes * decode_seconds + summarize_seconds + timings[batch_lines], 1e-6)
+    core_bytes_per_second = raw_bytes / core_seconds
+    io_bytes_per_second = raw_bytes / max(read_seconds, 1e-6)
+    if single_stream:
+        io_bytes_per_second = min(io_bytes_per_second, raw_bytes / max(decode_seconds, 1e-6))
+
+    limits = [
+        (cpus, 'CPU cores'),
+        (max(1, -(-int(io_bytes_per_second) // max(int(core_bytes_per_second), 1))), 'I/O bandwidth'),
+        (file_tasks, 'file size')
+    ]
+
+    base_mb = current_memory_mb()
+    if memory_limit_mb:
+        budget_mb = memory_limit_mb - base_mb
+        if budget_mb < base_mb + line_mb * batch_lines:
+            fitting = [size for size in AUTO_TUNE_BATCH_SIZES if base_mb + line_mb * size <= budget_mb]
+            batch_lines = max(fitting) if fitting else AUTO_TUNE_BATCH_SIZES[0]
+        limits.append((max(1, int(budget_mb // (base_mb + line_mb * batch_lines))), 'memory limit'))
+
+    processes, limited_by = min(limits, key=lambda limit: limit[0])
+
+    tuning.update({
+        'processes': processes,
+        'batch_lines': batch_lines,
+        'limited_by': limited_by,
+        'core_lines_per_second': len(lines) / core_seconds,
+        'io_mb_per_second': io_bytes_per_second / (1024 * 1024),
+        'worker_memory_mb': base_mb + line_mb * batch_lines
+    })
+    return tuning
+
+
+def append_file(destination, source_path):
+    with open(source_path, 'rb') as source:
+        size = os.fstat(source.fileno()).st_size
+        remaining = size
+        destination.flush()
+
+        try:
+            while remaining > 0:
+                if hasattr(os, 'copy_file_range'):
+                    copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining)
+                else:
+                    copied = os.sendfile(destination.fileno(), source.fileno(), None, remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except (AttributeError, OSError):
+            shutil.copyfileobj(source, destination)
+
+    return size
+
+
+def format_quarantine(entries):
+    return ''.join(f"{reason}\t{line}\n" for reason, line in entries).encode('utf-8', 'surrogateescape')
+
+
+def init_worker(progress_counters, batch_lines=OUTPUT_BATCH_LINES, timing=False, profile_dir=None, quarantine=False):
+    global worker_progress, worker_batch_lines, worker_timing, worker_profiler, worker_profile_dir, worker_quarantine
+    worker_progress = progress_counters
+    worker_batch_lines = batch_lines
+    worker_timing = timing
+    worker_quarantine = quarantine
+
+    # Forked workers inherit the parent's profile hook, which would slow them down and never be saved.
+    sys.setprofile(None)
+    if profile_dir:
+        worker_profiler = cProfile.Profile()
+        worker_profile_dir = profile_dir
+
+
+def profiled_call(args):
+    task, task_args = args
+    worker_profiler.enable()
+    try:
+        return task(task_args)
+    finally:
+        worker_profiler.disable()
+        worker_profiler.dump_stats(os.path.join(worker_profile_dir, f"worker-{os.getpid()}.prof"))
+
+
+def merge_profiles(profile_file, profile_dir):
+    paths = sorted(os.path.join(profile_dir, name) for name in os.listdir(profile_dir) if name.endswith('.prof'))
+    if not paths:
+        return None
+
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    stats.dump_stats(profile_file)
+    return pstats.Stats(profile_file, stream=sys.stdout)
+
+
+def process_chunk(args):
+    global terminate_flag
+    file_path, start_offset, end_offset, worker_id, initial_state, output_dir, compression = args
+
+    timer = StageTimer(worker_timing)
+    calculator = ShippingCalculator()
+    calculator.load_monthly_state(initial_state)
+    calculator.stage_timer = timer
+    sample_results = []
+    lines_processed = 0
+    bytes_processed = 0
+    bytes_flushed = 0
+
+    output_path = None
+    output = None
+    quarantine_path = None
+    quarantine = None
+    if output_dir:
+        output_path = os.path.join(output_dir, f"chunk_{worker_id:06d}.txt")
+        output = open(output_path, 'wb')
+        if worker_quarantine:
+            quarantine_path = os.path.join(output_dir, f"chunk_{worker_id:06d}.quarantine")
+            quarantine = open(quarantine_path, 'wb')
+            calculator.quarantine = []
+
+    def flush_batch(batch):
+        nonlocal bytes_flushed
+        timer.mark('read', bytes_processed - bytes_flushed)
+        bytes_flushed = bytes_processed
+
+        results = [result for result in calculator.process_batch(batch) if result]
+        if output and results:
+            data = b'\n'.join(results) + b'\n'
+            output.write(data)
+            timer.mark('write', len(data))
+        if quarantine and calculator.quarantine:
+            quarantine.write(format_quarantine(calculator.quarantine))
+            calculator.quarantine.clear()
+        if len(sample_results) < RESULT_SAMPLE_SIZE:
+            sample_results.extend(result.decode('utf-8', 'surrogateescape')
+                                  for result in results[:RESULT_SAMPLE_SIZE - len(sample_results)])
+    
+    for batch, nbytes in read_chunk_batches(file_path, start_offset, end_offset, compression, worker_id,
+                                            worker_batch_lines):
+        if terminate_flag:
+            break
+
+        lines_processed += len(batch)
+        bytes_processed += nbytes
+        flush_batch(batch)
+        if worker_progress is not None and not compression:
+            worker_progress[worker_id] = bytes_processed
+    
+    if worker_progress is not None:
+        worker_progress[worker_id] = end_offset - start_offset if compression else bytes_processed
+
+    if output:
+        output.close()
+        timer.mark('write')
+    if quarantine:
+        quarantine.close()
+    
+    result = {
+        'sample_results': sample_results,
+        'output_path': output_path,
+        'quarantine_path': quarantine_path,
+        'lines_processed': calculator.lines_processed,
+        'valid_lines': calculator.valid_lines,
+        'ignored_lines': calculator.ignored_lines,
+        'ignored_reasons': dict(calculator.ignored_reasons),
+        'total_discount_applied': calculator.total_discount_applied,
+        'provider_counts': dict(calculator.provider_counts),
+        'size_counts': dict(calculator.size_counts),
+        'monthly_state': calculator.get_monthly_state(),
+        'chunk_size': lines_processed,
+        'start_offset': start_offset,
+        'end_offset': end_offset,
+        'timings': None
+    }
+
+    if timer.enabled:
+        result['timings'] = {'pid': os.getpid(), 'stages': timer.stages}
+        timer.restart()
+        timer.mark('result_pickle', len(pickle.dumps(result)))
+
+    return result
+
+
+def process_block(args):
+    block, initial_state = args
+
+    calculator = ShippingCalculator()
+    calculator.load_monthly_state(initial_state)
+    if worker_quarantine:
+        calculator.quarantine = []
+
+    lines = block.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+
+    output = []
+    for i in range(0, len(lines), worker_batch_lines):
+        if terminate_flag:
+            break
+        output.extend(result for result in calculator.process_batch(lines[i:i + worker_batch_lines]) if result)
+
+    return {
+        'output': b'\n'.join(output) + b'\n' if output else b'',
+        'quarantine': format_quarantine(calculator.quarantine) if calculator.quarantine else b'',
+        'lines_processed': calculator.lines_processed,
+        'valid_lines': calculator.valid_lines,
+        'ignored_lines': calculator.ignored_lines,
+        'ignored_reasons': dict(calculator.ignored_reasons),
+        'total_discount_applied': calculator.total_discount_applied,
+        'provider_counts': dict(calculator.provider_counts),
+        'size_counts': dict(calculator.size_counts)
+    }
+
+
+def merge_chunk_stats(calculator, result):
+    calculator.lines_processed += result['lines_processed']
+    calculator.valid_lines += result['valid_lines']
+    calculator.ignored_lines += result['ignored_lines']
+    calculator.total_discount_applied += result['total_discount_applied']
+
+    for reason, count in result['ignored_reasons'].items():
+        calculator.ignored_reasons[reason] += count
+
+    for provider, count in result['provider_counts'].items():
+        calculator.provider_counts[provider] += count
+
+    for size, count in result['size_counts'].items():
+        calculator.size_counts[size] += count
+
+
+def process_file_parallel(input_file, output_file=None, num_processes=None, checkpoint_file=None, memory_limit_mb=None,
+                          timings_file=None, profile_dir=None, metrics=None, quarantine_file=None):
+    global terminate_flag
+    run_stats = RunStats()
+    run_stats.start()
+    
+    tune = num_processes == 'auto' or memory_limit_mb is not None
+    max_processes = num_processes if isinstance(num_processes, int) else None
+    if max_processes is None:
+        num_processes = min(4, mp.cpu_count())
+
+    GREEN = '\033[32m'
+    YELLOW = '\033[33m'
+    BLUE = '\033[34m'
+    MAGENTA = '\033[35m'
+    CYAN = '\033[36m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+    
+    calculator = ShippingCalculator()
+
+    print(f"\n{BOLD}{CYAN}Analyzing file:{END} {YELLOW}{input_file}{END}")
+    
+    file_size = get_file_size(input_file)
+    start_offset = 0
+    end_offset = file_size
+    checkpoint = None
+
+    if file_size and is_compiled_file(input_file):
+        if checkpoint_file or timings_file or metrics:
+            print("Error: --checkpoint, --timings, --metrics and --metrics-port require a text input file.")
+            return None
+        return process_compiled_file(input_file, output_file, quarantine_file)
+
+    compression = detect_compression(input_file) if file_size else None
+    single_stream = False
+    if compression:
+        if checkpoint_file:
+            print("Error: --checkpoint requires an uncompressed input file.")
+            return None
+
+        member_offsets = index_compressed_members(input_file, compression, file_size)
+        single_stream = not member_offsets or len(member_offsets) < 2
+        if single_stream and (timings_file or metrics):
+            print("Error: --timings, --metrics and --metrics-port require an uncompressed "
+                  "or multi-member compressed input file.")
+            return None
+        if not single_stream:
+            print(f"{BOLD}{BLUE}Detected {compression} input with {len(member_offsets):,} independent members{END}")
+
+    if checkpoint_file:
+        if os.path.exists(checkpoint_file):
+            try:
+                checkpoint = load_checkpoint(checkpoint_file, input_file, calculator)
+            except (ValueError, KeyError, OSError) as e:
+                print(f"Error loading checkpoint '{checkpoint_file}': {str(e)}")
+                return None
+
+            if output_file and checkpoint['output_size'] is None:
+                print(f"Error: checkpoint '{checkpoint_file}' was written by a run without an output file, "
+                      f"so '{output_file}' cannot be resumed from it.")
+                return None
+
+            if output_file and (not os.path.exists(output_file) or os.path.getsize(output_file) < checkpoint['output_size']):
+                print(f"Error: '{output_file}' is missing or shorter than the {checkpoint['output_size']:,} bytes "
+                      f"recorded in checkpoint '{checkpoint_file}', so it cannot be resumed.")
+                return None
+
+            quarantine_size = checkpoint.get('quarantine_size')
+            if quarantine_file and quarantine_size is None:
+                print(f"Error: checkpoint '{checkpoint_file}' was written by a run without --quarantine, "
+                      f"so '{quarantine_file}' cannot be resumed from it.")
+                return None
+
+            if quarantine_file and (not os.path.exists(quarantine_file) or os.path.getsize(quarantine_file) < quarantine_size):
+                print(f"Error: '{quarantine_file}' is missing or shorter than the {quarantine_size:,} bytes "
+                      f"recorded in checkpoint '{checkpoint_file}', so it cannot be resumed.")
+                return None
+
+            start_offset = checkpoint['offset']
+            print(f"{BOLD}{BLUE}Resuming from checkpoint at {start_offset / (1024 * 1024):,.1f} MB{END}")
+
+        end_offset = find_last_line_end(input_file, start_offset, file_size)
+
+    pool = None
+    output_dir = None
+    output = None
+    quarantine = None
+    
+    try:
+        if tune:
+            sample_bytes = auto_tune_sample_bytes(end_offset - start_offset)
+            print(f"{BOLD}{MAGENTA}Auto-tuning on a {sample_bytes / (1024 * 1024):,.2f} MB sample...{END}")
+            calculator.tuning = auto_tune(input_file, end_offset - start_offset, start_offset, compression,
+                                          single_stream, memory_limit_mb, max_processes)
+            num_processes = calculator.tuning['processes']
+            print(f"{BOLD}{BLUE}Using {num_processes} parallel processes with {calculator.tuning['batch_lines']:,}-line batches "
+                  f"(limited by {calculator.tuning['limited_by']}){END}")
+        else:
+            print(f"{BOLD}{BLUE}Using {num_processes} parallel processes{END}")
+
+        if single_stream:
+            return process_compressed_stream(input_file, output_file, num_processes, compression, calculator.tuning,
+                                             profile_dir, quarantine_file)
+
+        total_bytes = end_offset - start_offset
+        print(f"{BOLD}{GREEN}Found {total_bytes / (1024 * 1024):,.1f} MB to process{END}")
+
+        # A single worker prices the tasks in order anyway, so instead of running the pre-pass
+        # each task starts from the monthly state the previous one ended with.
+        pre_pass = num_processes > 1
+        passes = 2 if pre_pass else 1
+
+        progress = SimpleProgressBar(max(total_bytes * passes, 1), prefix='Processing', unit='MB', unit_size=1024 * 1024)
+
+        print(f"{BOLD}{MAGENTA}Dividing file into tasks...{END}")
+        num_tasks = count_tasks(total_bytes, num_processes)
+        if compression:
+            chunk_boundaries = compute_member_chunk_boundaries(member_offsets, file_size, num_tasks)
+        else:
+            chunk_boundaries = compute_chunk_boundaries(input_file, end_offset, num_tasks, start_offset)
+        num_chunks = len(chunk_boundaries)
+        chunk_size = total_bytes // max(num_chunks, 1)
+
+        print(f"{BOLD}{GREEN}Created {num_chunks} tasks of approximately {chunk_size / (1024 * 1024):,.1f} MB each{END}")
+
+        progress_counters = mp.RawArray('q', max(num_chunks * passes, 1))
+
+        all_results = []
+        parent_timer = StageTimer(timings_file is not None)
+        worker_timers = defaultdict(StageTimer)
+
+        def update_progress_thread():
+            global terminate_flag
+            total_processed = 0
+            while total_processed < total_bytes * passes and not terminate_flag:
+                total_processed = sum(progress_counters)
+
+                progress.update(min(total_processed, total_bytes * passes))
+
+                if total_processed >= total_bytes * passes * 0.99:
+                    break
+
+                time.sleep(0.1)
+
+        if output_file:
+            output_dir = tempfile.mkdtemp(prefix='.shipping_chunks_', dir=os.path.dirname(os.path.abspath(output_file)))
+            if checkpoint:
+                output = open(output_file, 'r+b')
+                output.truncate(checkpoint['output_size'])
+                output.seek(0, os.SEEK_END)
+            else:
+                output = open(output_file, 'wb')
+
+        if quarantine_file:
+            if checkpoint:
+                quarantine = open(quarantine_file, 'r+b')
+                quarantine.truncate(checkpoint['quarantine_size'])
+                quarantine.seek(0, os.SEEK_END)
+            else:
+                quarantine = open(quarantine_file, 'wb')
+
+        batch_lines = calculator.tuning['batch_lines'] if calculator.tuning else OUTPUT_BATCH_LINES
+        pool = mp.Pool(processes=num_processes, initializer=init_worker,
+                       initargs=(progress_counters, batch_lines, parent_timer.enabled, profile_dir, quarantine is not None))
+        parent_timer.mark('startup')
+
+        summary_task = summarize_chunk_timed if parent_timer.enabled else summarize_chunk
+
+        def submit_summary(i):
+            summary_args = (input_file, chunk_boundaries[i][0], chunk_boundaries[i][1], compression, num_chunks + i)
+            if profile_dir:
+                return pool.apply_async(profiled_call, ((summary_task, summary_args),))
+            return pool.apply_async(summary_task, (summary_args,))
+
+        # Summaries are submitted at most num_processes tasks ahead of pricing, so the pool's
+        # queue interleaves the two passes instead of finishing every summary first.
+        summary_results = []
+        if pre_pass:
+            summary_results = [submit_summary(i) for i in range(min(num_processes, num_chunks))]
+
+        state_calculator = ShippingCalculator()
+        if checkpoint:
+            state_calculator.load_monthly_state(checkpoint['monthly_state'])
+
+        update_thread = threading.Thread(target=update_progress_thread)
+        update_thread.daemon = True
+        update_thread.start()
+
+        def metrics_snapshot(finished=False):
+            active_tasks = {}
+            for i, (start, end) in enumerate(chunk_boundaries):
+                if 0 < progress_counters[i] < end - start:
+                    active_tasks[str(i)] = {'bytes_processed': progress_counters[i], 'bytes_total': end - start}
+            return run_metrics(calculator, run_stats, min(sum(progress_counters[:num_chunks]), total_bytes), total_bytes,
+                               state_calculator.monthly_discounts, active_tasks, finished)
+
+        if metrics:
+            metrics.start(metrics_snapshot)
+            if metrics.port is not None:
+                print(f"{BOLD}{BLUE}Serving live metrics on http://127.0.0.1:{metrics.port}/metrics{END}")
+
+        def collect(result):
+            parent_timer.mark('wait_result')
+            if output_file is None:
+                all_results.extend(result['sample_results'] if len(all_results) < RESULT_SAMPLE_SIZE else [])
+            else:
+                appended = append_file(output, result['output_path'])
+                os.unlink(result['output_path'])
+                if result['quarantine_path']:
+                    appended += append_file(quarantine, result['quarantine_path'])
+                    os.unlink(result['quarantine_path'])
+                parent_timer.mark('append', appended)
+
+            merge_chunk_stats(calculator, result)
+            if not pre_pass:
+                state_calculator.load_monthly_state(result['monthly_state'])
+            if result['timings']:
+                worker_timers[result['timings']['pid']].merge(result['timings']['stages'])
+            parent_timer.mark('merge')
+
+        pending_results = []
+        next_result = 0
+
+        for i in range(num_chunks):
+            if terminate_flag:
+                break
+
+            if pre_pass:
+                summaries = summary_results[i].get()
+                summary_results[i] = None
+                parent_timer.mark('wait_summary')
+                if parent_timer.enabled:
+                    summaries, pid, stages = summaries
+                    worker_timers[pid].merge(stages)
+                initial_state = advance_monthly_state(state_calculator, summaries)
+            else:
+                while next_result < len(pending_results) and not terminate_flag:
+                    collect(pending_results[next_result].get())
+                    pending_results[next_result] = None
+                    next_result += 1
+                initial_state = state_calculator.get_monthly_state()
+            parent_timer.mark('state')
+            chunk_args = (input_file, chunk_boundaries[i][0], chunk_boundaries[i][1], i, initial_state, output_dir, compression)
+            if profile_dir:
+                pending_results.append(pool.apply_async(profiled_call, ((process_chunk, chunk_args),)))
+            else:
+                pending_results.append(pool.apply_async(process_chunk, (chunk_args,)))
+            if pre_pass and len(summary_results) < num_chunks:
+                summary_results.append(submit_summary(len(summary_results)))
+            parent_timer.mark('dispatch')
+
+            while next_result < len(pending_results) and pending_results[next_result].ready():
+                collect(pending_results[next_result].get())
+                pending_results[next_result] = None
+                next_result += 1
+
+        while next_result < len(pending_results) and not terminate_flag:
+            collect(pending_results[next_result].get())
+            pending_results[next_result] = None
+            next_result += 1
+
+        if terminate_flag:
+            if pool:
+                pool.terminate()
+                pool.join()
+            print("\nProcess terminated by user.")
+            return None
+
+        if pool:
+            pool.close()
+            pool.join()
+        parent_timer.mark('shutdown')
+            
+        if terminate_flag:
+            return None
+
+        calculator.load_monthly_state(state_calculator.get_monthly_state())
+
+        progress.update(progress.total)
+
+        if output:
+            output.close()
+        if quarantine:
+            quarantine.close()
+
+        if checkpoint_file:
+            save_checkpoint(checkpoint_file, input_file, end_offset, calculator.get_monthly_state(),
+                            os.path.getsize(output_file) if output_file else None,
+                            os.path.getsize(quarantine_file) if quarantine_file else None)
+
+        run_stats.end()
+        calculator.print_statistics(run_stats)
+
+        if quarantine_file:
+            print(f"{BOLD}{BLUE}Rejected lines saved to {quarantine_file}{END}")
+
+        if metrics:
+            metrics.stop(metrics_snapshot(finished=True))
+            if metrics.metrics_file:
+                print(f"{BOLD}{BLUE}Metrics saved to {metrics.metrics_file}{END}")
+
+        if timings_file:
+            save_timing_report(timings_file, input_file, num_processes, run_stats, calculator, parent_timer, worker_timers)
+            print(f"{BOLD}{BLUE}Stage timings saved to {timings_file}{END}")
+        
+        print()
+
+        if output_file is None:
+            return all_results
+        
+    except KeyboardInterrupt:
+        print("\nProcess interrupted by user.")
+        if pool:
+            pool.terminate()
+            pool.join()
+        return None
+        
+    except Exception as e:
+        if not terminate_flag:
+            print(f"Error processing file: {str(e)}")
+            import traceback
+            print(traceback.format_exc())
+        if pool:
+            pool.terminate()
+            pool.join()
+        return None
+
+    finally:
+        if metrics:
+            metrics.stop()
+        if output:
+            output.close()
+        if quarantine:
+            quarantine.close()
+        if output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def save_timing_report(path, input_file, num_processes, run_stats, calculator, parent_timer, worker_timers):
+    worker_totals = StageTimer()
+    for timer in worker_timers.values():
+        worker_totals.merge(timer.stages)
+
+    report = {
+        'version': TIMING_REPORT_VERSION,
+        'input_file': input_file,
+        'processes': num_processes,
+        'wall_seconds': run_stats.get_elapsed_time(),
+        'lines_processed': calculator.lines_processed,
+        'bytes_processed': worker_totals.stages.get('read', [0, 0, 0, 0])[2],
+        'parent': parent_timer.report(),
+        'worker_totals': worker_totals.report(),
+        'workers': {str(pid): timer.report() for pid, timer in sorted(worker_timers.items())}
+    }
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def run_metrics(calculator, run_stats, bytes_processed, bytes_total, monthly_discounts, active_tasks, finished=False):
+    elapsed = max(run_stats.get_elapsed_time(), 1e-9)
+    return {
+        'version': METRICS_VERSION,
+        'finished': finished,
+        'start_time': run_stats.start_time.isoformat(timespec='seconds'),
+        'elapsed_seconds': elapsed,
+        'lines_processed': calculator.lines_processed,
+        'valid_lines': calculator.valid_lines,
+        'ignored_lines': calculator.ignored_lines,
+        'ignored_reasons': {reason: calculator.ignored_reasons.get(reason, 0) for reason in REJECT_REASONS},
+        'total_discount_applied': round(calculator.total_discount_applied, 2),
+        'lines_per_second': calculator.lines_processed / elapsed,
+        'bytes_processed': bytes_processed,
+        'bytes_total': bytes_total,
+        'bytes_per_second': bytes_processed / elapsed,
+        'provider_counts': dict(calculator.provider_counts),
+        'size_counts': dict(calculator.size_counts),
+        'monthly_discounts': {month: round(discount, 2) for month, discount in sorted(dict(monthly_discounts).items())},
+        'active_tasks': active_tasks
+    }
+
+
+def format_prometheus(metrics):
+    lines = []
+
+    def metric(name, kind, help_text, values):
+        lines.append(f"# HELP shipping_{name} {help_text}")
+        lines.append(f"# TYPE shipping_{name} {kind}")
+        for labels, value in values:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"shipping_{name}{{{label_text}}} {value}" if label_text else f"shipping_{name} {value}")
+
+    metric('lines_processed_total', 'counter', "Input lines priced", [({}, metrics['lines_processed'])])
+    metric('valid_lines_total', 'counter', "Valid transactions", [({}, metrics['valid_lines'])])
+    metric('ignored_lines_total', 'counter', "Ignored input lines", [({}, metrics['ignored_lines'])])
+    metric('ignored_lines_by_reason_total', 'counter', "Ignored input lines per rejection reason",
+           [({'reason': reason}, count) for reason, count in metrics['ignored_reasons'].items()])
+    metric('discount_eur_total', 'counter', "Total discount applied in EUR", [({}, metrics['total_discount_applied'])])
+    metric('shipments_by_provider_total', 'counter', "Valid shipments per provider",
+           [({'provider': provider}, count) for provider, count in sorted(metrics['provider_counts'].items())])
+    metric('shipments_by_size_total', 'counter', "Valid shipments per package size",
+           [({'size': size}, count) for size, count in sorted(metrics['size_counts'].items())])
+    metric('month_discount_eur', 'gauge', "Discount applied per calendar month in EUR",
+           [({'month': month}, discount) for month, discount in metrics['monthly_discounts'].items()])
+    metric('bytes_processed', 'gauge', "Input bytes processed so far", [({}, metrics['bytes_processed'])])
+    metric('bytes_total', 'gauge', "Input bytes in this run", [({}, metrics['bytes_total'])])
+    metric('lines_per_second', 'gauge', "Average lines priced per second", [({}, f"{metrics['lines_per_second']:.1f}")])
+    metric('bytes_per_second', 'gauge', "Average input bytes processed per second", [({}, f"{metrics['bytes_per_second']:.1f}")])
+    metric('elapsed_seconds', 'gauge', "Seconds since the run started", [({}, f"{metrics['elapsed_seconds']:.3f}")])
+    metric('task_bytes_processed', 'gauge', "Bytes processed by each running task",
+           [({'task': task}, progress['bytes_processed']) for task, progress in metrics['active_tasks'].items()])
+    metric('run_finished', 'gauge', "1 once the run has finished", [({}, int(metrics['finished']))])
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    def __init__(self, metrics_file=None, port=None, interval=METRICS_INTERVAL_SECONDS):
+        self.metrics_file = metrics_file
+        self.port = port
+        self.interval = interval
+        self.snapshot = None
+        self.server = None
+        self.writer = None
+        self.stopped = threading.Event()
+
+    def render(self, metrics, prometheus):
+        return format_prometheus(metrics) if prometheus else json.dumps(metrics, indent=2) + '\n'
+
+    def write(self, metrics):
+        temp_file = f"{self.metrics_file}.tmp"
+        with open(temp_file, 'w') as f:
+            f.write(self.render(metrics, self.metrics_file.endswith('.prom')))
+        os.replace(temp_file, self.metrics_file)
+
+    def start(self, snapshot):
+        self.snapshot = snapshot
+        self.stopped.clear()
+
+        if self.port is not None:
+            exporter = self
+
+            class MetricsHandler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path not in ('/metrics', '/metrics.json'):
+                        self.send_error(404)
+                        return
+
+                    prometheus = self.path == '/metrics'
+                    body = exporter.render(exporter.snapshot(), prometheus).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4' if prometheus else 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), MetricsHandler)
+            self.port = self.server.server_address[1]
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        if self.metrics_file:
+            def write_loop():
+                while not self.stopped.wait(self.interval):
+                    self.write(self.snapshot())
+
+            self.writer = threading.Thread(target=write_loop, daemon=True)
+            self.writer.start()
+
+    def stop(self, final_metrics=None):
+        self.stopped.set()
+        if self.writer:
+            self.writer.join()
+            self.writer = None
+        if self.metrics_file and final_metrics:
+            self.write(final_metrics)
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def process_compressed_stream(input_file, output_file, num_processes, compression, tuning=None, profile_dir=None,
+                              quarantine_file=None):
+    global terminate_flag
+    run_stats = RunStats()
+    run_stats.start()
+
+    GREEN = '\033[32m'
+    BLUE = '\033[34m'
+    MAGENTA = '\033[35m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    file_size = get_file_size(input_file)
+    print(f"{BOLD}{BLUE}Detected {compression} input that cannot be split; decompressing in a dedicated thread{END}")
+    print(f"{BOLD}{GREEN}Found {file_size / (1024 * 1024):,.1f} MB of compressed data to process{END}")
+
+    progress = SimpleProgressBar(max(file_size, 1), prefix='Processing', unit='MB', unit_size=1024 * 1024)
+    blocks = queue.Queue(COMPRESSED_QUEUE_BLOCKS)
+    errors = []
+
+    def decompress_thread():
+        try:
+            with open(input_file, 'rb') as raw:
+                stream = open_decompressed(raw, compression)
+                pending = b''
+
+                while not terminate_flag:
+                    data = stream.read(COMPRESSED_BLOCK_SIZE)
+                    if not data:
+                        break
+
+                    data = pending + data
+                    cut = data.rfind(b'\n') + 1
+                    if cut:
+                        blocks.put(data[:cut])
+                    pending = data[cut:]
+                    progress.update(raw.tell())
+
+                if pending:
+                    blocks.put(pending)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            blocks.put(None)
+
+    calculator = ShippingCalculator()
+    calculator.tuning = tuning
+    state_calculator = ShippingCalculator()
+    all_results = []
+    summarizing = []
+    pricing = []
+    window = 2 * num_processes
+    exhausted = False
+
+    pool = None
+    output = None
+    quarantine = None
+
+    try:
+        if output_file:
+            output = open(output_file, 'wb')
+        if quarantine_file:
+            quarantine = open(quarantine_file, 'wb')
+
+        batch_lines = tuning['batch_lines'] if tuning else OUTPUT_BATCH_LINES
+        pool = mp.Pool(processes=num_processes, initializer=init_worker,
+                       initargs=(None, batch_lines, False, profile_dir, quarantine is not None))
+        print(f"{BOLD}{MAGENTA}Pricing decompressed blocks as they arrive...{END}")
+
+        reader = threading.Thread(target=decompress_thread)
+        reader.daemon = True
+        reader.start()
+
+        while not terminate_flag:
+            while not exhausted and len(summarizing) + len(pricing) < window:
+                block = blocks.get()
+                if block is None:
+                    exhausted = True
+                    break
+                if profile_dir:
+                    summarizing.append((block, pool.apply_async(profiled_call, ((summarize_block, block),))))
+                else:
+                    summarizing.append((block, pool.apply_async(summarize_block, (block,))))
+
+            if summarizing:
+                block, pending_summary = summarizing.pop(0)
+                summaries = pending_summary.get()
+                initial_state = state_calculator.get_monthly_state(summaries)
+                for month_key, summary in summaries.items():
+                    state_calculator.replay_month(month_key, summary)
+                if profile_dir:
+                    pricing.append(pool.apply_async(profiled_call, ((process_block, (block, initial_state)),)))
+                else:
+                    pricing.append(pool.apply_async(process_block, ((block, initial_state),)))
+
+            if pricing and (pricing[0].ready() or not summarizing or len(summarizing) + len(pricing) >= window):
+                result = pricing.pop(0).get()
+
+                if output:
+                    output.write(result['output'])
+                elif len(all_results) < RESULT_SAMPLE_SIZE:
+                    all_results.extend(line.decode('utf-8', 'surrogateescape') for line in
+                                       result['output'].split(b'\n', RESULT_SAMPLE_SIZE)[:RESULT_SAMPLE_SIZE] if line)
+                if quarantine:
+                    quarantine.write(result['quarantine'])
+
+                merge_chunk_stats(calculator, result)
+
+            if exhausted and not summarizing and not pricing:
+                break
+
+        if terminate_flag:
+            print("\nProcess terminated by user.")
+            return None
+
+        if errors:
+            raise errors[0]
+
+        pool.close()
+        pool.join()
+        pool = None
+
+        calculator.load_monthly_state(state_calculator.get_monthly_state())
+        progress.update(progress.total)
+
+        if output:
+            output.close()
+        if quarantine:
+            quarantine.close()
+
+        run_stats.end()
+        calculator.print_statistics(run_stats)
+
+        if quarantine_file:
+            print(f"{BOLD}{BLUE}Rejected lines saved to {quarantine_file}{END}")
+
+        print()
 
         if output_file is None:
             return all_results
-        
+
     except KeyboardInterrupt:
         print("\nProcess interrupted by user.")
-        if pool:
-            pool.terminate()
-            pool.join()
         return None
-        
+
     except Exception as e:
         if not terminate_flag:
             print(f"Error processing file: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
+        return None
+
+    finally:
         if pool:
             pool.terminate()
             pool.join()
+        if output:
+            output.close()
+        if quarantine:
+            quarantine.close()
+
+
+def process_compiled_file(input_file, output_file=None, quarantine_file=None):
+    global terminate_flag
+    run_stats = RunStats()
+    run_stats.start()
+
+    GREEN = '\033[32m'
+    BLUE = '\033[34m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    calculator = ShippingCalculator()
+    all_results = []
+    output = None
+    quarantine = None
+
+    try:
+        with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            footer = read_compiled_footer(mm)
+            rows = footer['rows']
+            pairs = [pair.encode() for pair in footer['pairs']]
+            exception_offsets = read_compiled_exception_offsets(mm, footer['sections'])
+
+            print(f"{BOLD}{BLUE}Detected compiled input with {rows:,} rows in {len(footer['months']):,} months{END}")
+            print(f"{BOLD}{GREEN}Pricing compiled rows directly, without text parsing{END}")
+
+            progress = SimpleProgressBar(max(rows, 1), prefix='Processing', unit='rows')
+            exception_index = 0
+
+            if output_file:
+                output = open(output_file, 'wb')
+            if quarantine_file:
+                quarantine = open(quarantine_file, 'wb')
+                calculator.quarantine = []
+
+            for start in range(0, rows, COMPILED_BATCH_ROWS):
+                if terminate_flag:
+                    break
+
+                end = min(start + COMPILED_BATCH_ROWS, rows)
+                days, codes, exception_lines, exception_index = read_compiled_rows(mm, footer['sections'], exception_offsets,
+                                                                                   start, end, exception_index)
+
+                if NUMPY_AVAILABLE:
+                    results = calculator.process_compiled_rows(days, codes, pairs, exception_lines)
+                else:
+                    results = calculator.process_batch(compiled_rows_to_lines(days, codes, pairs, exception_lines))
+
+                results = [result for result in results if result]
+                if output and results:
+                    output.write(b'\n'.join(results) + b'\n')
+                elif not output and len(all_results) < RESULT_SAMPLE_SIZE:
+                    all_results.extend(result.decode('utf-8', 'surrogateescape')
+                                       for result in results[:RESULT_SAMPLE_SIZE - len(all_results)])
+                if quarantine and calculator.quarantine:
+                    quarantine.write(format_quarantine(calculator.quarantine))
+                    calculator.quarantine.clear()
+
+                progress.update(end)
+
+    except (ValueError, KeyError, OSError) as e:
+        print(f"Error reading compiled file '{input_file}': {str(e)}")
+        return None
+
+    finally:
+        if output:
+            output.close()
+        if quarantine:
+            quarantine.close()
+
+    if terminate_flag:
+        print("\nProcess terminated by user.")
+        return None
+
+    run_stats.end()
+    calculator.print_statistics(run_stats)
+
+    if quarantine_file:
+        print(f"{BOLD}{BLUE}Rejected lines saved to {quarantine_file}{END}")
+
+    print()
+
+    if output_file is None:
+        return all_results
+
+
+def process_selected_months(input_file, output_file, months, index_file=None, num_processes=None, profile_dir=None):
+    global terminate_flag
+    run_stats = RunStats()
+    run_stats.start()
+
+    GREEN = '\033[32m'
+    YELLOW = '\033[33m'
+    BLUE = '\033[34m'
+    MAGENTA = '\033[35m'
+    CYAN = '\033[36m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    print(f"\n{BOLD}{CYAN}Analyzing file:{END} {YELLOW}{input_file}{END}")
+    print(f"{BOLD}{BLUE}Pricing only: {', '.join(months)}{END}")
+
+    file_size = get_file_size(input_file)
+    if file_size and is_compiled_file(input_file):
+        if index_file:
+            print("Error: --index requires a text input file; compiled files carry their own month index.")
+            return None
+        return process_compiled_months(input_file, output_file, months)
+
+    if file_size and detect_compression(input_file):
+        print("Error: --months requires an uncompressed text or compiled input file.")
+        return None
+
+    index = load_month_index(index_file, input_file) if index_file else None
+    if index is None:
+        print(f"{BOLD}{MAGENTA}Building month index...{END}")
+        index = build_month_index(input_file, num_processes, profile_dir)
+        if index_file:
+            save_month_index(index_file, index)
+            print(f"{BOLD}{GREEN}Saved month index to {index_file}{END}")
+
+    selected = set(months)
+    ranges = sorted({tuple(byte_range) for month_key in selected for byte_range in index['months'].get(month_key, [])})
+    merged = []
+    for start_offset, end_offset in ranges:
+        if merged and start_offset <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end_offset)
+        else:
+            merged.append([start_offset, end_offset])
+
+    total_bytes = sum(end_offset - start_offset for start_offset, end_offset in merged)
+    print(f"{BOLD}{GREEN}Reading {total_bytes / (1024 * 1024):,.1f} MB of {index['file_size'] / (1024 * 1024):,.1f} MB{END}")
+
+    progress = SimpleProgressBar(max(total_bytes, 1), prefix='Processing', unit='MB', unit_size=1024 * 1024)
+    calculator = ShippingCalculator()
+    all_results = []
+    bytes_processed = 0
+    output = open(output_file, 'wb') if output_file else None
+
+    def flush_batch(batch):
+        results = [result for result in calculator.process_batch(batch) if result]
+        if output and results:
+            output.write(b'\n'.join(results) + b'\n')
+        elif not output and len(all_results) < RESULT_SAMPLE_SIZE:
+            all_results.extend(result.decode('utf-8', 'surrogateescape')
+                               for result in results[:RESULT_SAMPLE_SIZE - len(all_results)])
+
+    try:
+        batch = []
+        for start_offset, end_offset in merged:
+            for line in read_chunk_from_file(input_file, start_offset, end_offset):
+                if terminate_flag:
+                    break
+
+                bytes_processed += len(line)
+                matched = calculator.match_transaction_bytes(line)
+                if matched is None or matched[0] not in selected:
+                    continue
+
+                batch.append(line)
+                if len(batch) >= OUTPUT_BATCH_LINES:
+                    flush_batch(batch)
+                    batch = []
+                    progress.update(bytes_processed)
+
+        if batch and not terminate_flag:
+            flush_batch(batch)
+
+    finally:
+        if output:
+            output.close()
+
+    if terminate_flag:
+        print("\nProcess terminated by user.")
+        return None
+
+    progress.update(progress.total)
+    run_stats.end()
+    calculator.print_statistics(run_stats)
+
+    print()
+
+    if output_file is None:
+        return all_results
+
+
+def process_compiled_months(input_file, output_file, months):
+    global terminate_flag
+    run_stats = RunStats()
+    run_stats.start()
+
+    GREEN = '\033[32m'
+    BLUE = '\033[34m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    selected = set(months)
+    calculator = ShippingCalculator()
+    all_results = []
+    output = None
+
+    def flush_batch(batch):
+        results = [result for result in calculator.process_batch(batch) if result]
+        if output and results:
+            output.write(b'\n'.join(results) + b'\n')
+        elif not output and len(all_results) < RESULT_SAMPLE_SIZE:
+            all_results.extend(result.decode('utf-8', 'surrogateescape')
+                               for result in results[:RESULT_SAMPLE_SIZE - len(all_results)])
+
+    try:
+        with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            footer = read_compiled_footer(mm)
+            sections = footer['sections']
+            pairs = [pair.encode() for pair in footer['pairs']]
+            exception_offsets = read_compiled_exception_offsets(mm, sections)
+
+            merged = []
+            for first, last in sorted((first, last + 1) for month_key, (_, first, last) in footer['months'].items()
+                                      if month_key in selected):
+                if merged and first <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], last)
+                else:
+                    merged.append([first, last])
+
+            total_rows = sum(last - first for first, last in merged)
+            print(f"{BOLD}{BLUE}Detected compiled input; using its month index{END}")
+            print(f"{BOLD}{GREEN}Reading {total_rows:,} of {footer['rows']:,} rows{END}")
+
+            progress = SimpleProgressBar(max(total_rows, 1), prefix='Processing', unit='rows')
+            rows_processed = 0
+            if output_file:
+                output = open(output_file, 'wb')
+
+            codes_start = sections['codes'][0]
+            for first, last in merged:
+                exception_index = mm[codes_start:codes_start + first].count(bytes([COMPILED_EXCEPTION_CODE]))
+
+                for start in range(first, last, COMPILED_BATCH_ROWS):
+                    if terminate_flag:
+                        break
+
+                    end = min(start + COMPILED_BATCH_ROWS, last)
+                    days, codes, exception_lines, exception_index = read_compiled_rows(mm, sections, exception_offsets,
+                                                                                       start, end, exception_index)
+
+                    batch = []
+                    for line in compiled_rows_to_lines(days, codes, pairs, exception_lines):
+                        matched = calculator.match_transaction_bytes(line)
+                        if matched is not None and matched[0] in selected:
+                            batch.append(line)
+                    flush_batch(batch)
+
+                    rows_processed += end - start
+                    progress.update(rows_processed)
+
+    except (ValueError, KeyError, OSError) as e:
+        print(f"Error reading compiled file '{input_file}': {str(e)}")
+        return None
+
+    finally:
+        if output:
+            output.close()
+
+    if terminate_flag:
+        print("\nProcess terminated by user.")
+        return None
+
+    progress.update(progress.total)
+    run_stats.end()
+    calculator.print_statistics(run_stats)
+
+    print()
+
+    if output_file is None:
+        return all_results
+
+
+def process_stream(input_stream, output_stream=None, calculator=None, block_size=STREAM_BLOCK_SIZE, quarantine_stream=None):
+    global terminate_flag
+    if calculator is None:
+        calculator = ShippingCalculator()
+    if quarantine_stream:
+        calculator.quarantine = []
+
+    sample_results = []
+    pending = b''
+
+    def flush_lines(lines):
+        results = [result for result in calculator.process_batch(lines) if result]
+        if output_stream and results:
+            output_stream.write(b'\n'.join(results) + b'\n')
+        if quarantine_stream and calculator.quarantine:
+            quarantine_stream.write(format_quarantine(calculator.quarantine))
+            calculator.quarantine.clear()
+        if len(sample_results) < RESULT_SAMPLE_SIZE:
+            sample_results.extend(result.decode('utf-8', 'surrogateescape')
+                                  for result in results[:RESULT_SAMPLE_SIZE - len(sample_results)])
+
+    while not terminate_flag:
+        block = input_stream.read(block_size)
+        if not block:
+            break
+
+        lines = block.split(b'\n')
+        lines[0] = pending + lines[0]
+        pending = lines.pop()
+
+        if lines:
+            flush_lines(lines)
+        if output_stream:
+            output_stream.flush()
+
+    if pending and not terminate_flag:
+        flush_lines([pending])
+
+    if output_stream:
+        output_stream.flush()
+
+    return sample_results
+
+
+def process_file_stream(input_file, output_file=None, quarantine_file=None):
+    global terminate_flag
+    run_stats = RunStats()
+    run_stats.start()
+
+    CYAN = '\033[36m'
+    YELLOW = '\033[33m'
+    BLUE = '\033[34m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    source = 'stdin' if input_file == '-' else input_file
+    print(f"\n{BOLD}{CYAN}Streaming from:{END} {YELLOW}{source}{END}")
+    print(f"{BOLD}{BLUE}Reading in {STREAM_BLOCK_SIZE // (1024 * 1024)} MB blocks with a single process{END}")
+
+    calculator = ShippingCalculator()
+    input_stream = None
+    output_stream = None
+    quarantine_stream = None
+
+    try:
+        input_stream = sys.stdin.buffer if input_file == '-' else open(input_file, 'rb')
+        if output_file == '-':
+            output_stream = sys.__stdout__.buffer
+        elif output_file:
+            output_stream = open(output_file, 'wb')
+        if quarantine_file:
+            quarantine_stream = open(quarantine_file, 'wb')
+
+        results = process_stream(input_stream, output_stream, calculator, quarantine_stream=quarantine_stream)
+
+    except FileNotFoundError:
+        print(f"Error: File '{input_file}' not found.")
+        return None
+
+    except BrokenPipeError:
+        terminate_flag = True
+        return None
+
+    finally:
+        if input_stream and input_file != '-':
+            input_stream.close()
+        if output_stream and output_file != '-':
+            output_stream.close()
+        if quarantine_stream:
+            quarantine_stream.close()
+
+    if terminate_flag:
         return None
 
+    run_stats.end()
+    calculator.print_statistics(run_stats)
+
+    if quarantine_file:
+        print(f"{BOLD}{BLUE}Rejected lines saved to {quarantine_file}{END}")
+    print()
+
+    return results if output_file is None else []
+
+
+class PricingServer:
+    def __init__(self, calculator=None):
+        self.calculator = calculator if calculator is not None else ShippingCalculator()
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.batch_task = None
+        self.server = None
+        self.unix_socket = None
+
+    def submit(self, lines):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((lines, future))
+        self.wakeup.set()
+        return future
+
+    async def run_batches(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            requests, self.pending = self.pending, []
+            lines = [line for group, _ in requests for line in group]
+
+            try:
+                if len(lines) < SERVER_MIN_BATCH_LINES:
+                    results = [self.calculator.process_transaction_bytes(line) for line in lines]
+                else:
+                    results = self.calculator.process_batch(lines)
+            except Exception as e:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            position = 0
+            for group, future in requests:
+                if not future.done():
+                    future.set_result(results[position:position + len(group)])
+                position += len(group)
+
+    async def write_responses(self, responses, writer):
+        connected = True
+        while True:
+            future = await responses.get()
+            if future is None:
+                break
+
+            if not connected:
+                continue
+
+            try:
+                results = [result for result in await future if result]
+                if results:
+                    writer.write(b'\n'.join(results) + b'\n')
+                    await writer.drain()
+            except Exception as e:
+                if not isinstance(e, ConnectionError):
+                    print(f"Error pricing request: {str(e)}")
+                connected = False
+                writer.close()
+
+    async def handle_client(self, reader, writer):
+        responses = asyncio.Queue(SERVER_MAX_PENDING)
+        writer_task = asyncio.create_task(self.write_responses(responses, writer))
+        pending = b''
+
+        try:
+            while True:
+                data = await reader.read(SERVER_READ_SIZE)
+                if not data:
+                    break
+
+                lines = data.split(b'\n')
+                lines[0] = pending + lines[0]
+                pending = lines.pop()
+
+                if lines:
+                    await responses.put(self.submit(lines))
+
+            if pending:
+                await responses.put(self.submit([pending]))
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await writer_task
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765, unix_socket=None):
+        self.batch_task = asyncio.create_task(self.run_batches())
+        self.unix_socket = unix_socket
+
+        if unix_socket:
+            self.server = await asyncio.start_unix_server(self.handle_client, path=unix_socket)
+        else:
+            self.server = await asyncio.start_server(self.handle_client, host, port)
+
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.batch_task:
+            self.batch_task.cancel()
+            self.batch_task = None
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_socket=None):
+        global terminate_flag
+        await self.start(host, port, unix_socket)
+
+        try:
+            while not terminate_flag:
+                await asyncio.sleep(0.2)
+        finally:
+            await self.stop()
+
+
+def run_pricing_server(host='127.0.0.1', port=8765, unix_socket=None):
+    run_stats = RunStats()
+    run_stats.start()
+
+    CYAN = '\033[36m'
+    YELLOW = '\033[33m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    address = unix_socket if unix_socket else f"{host}:{port}"
+    print(f"\n{BOLD}{CYAN}Pricing service listening on:{END} {YELLOW}{address}{END}")
+    print(f"{BOLD}{CYAN}Send newline-delimited transactions; press Ctrl+C to stop{END}")
+
+    server = PricingServer()
+    try:
+        asyncio.run(server.serve(host, port, unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+    run_stats.end()
+    server.calculator.print_statistics(run_stats)
+    print()
+
+
+def save_profile(profiler, profile_file, profile_dir):
+    BLUE = '\033[34m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    profiler.disable()
+    profiler.dump_stats(os.path.join(profile_dir, 'parent.prof'))
+    workers = sum(1 for name in os.listdir(profile_dir) if name.startswith('worker-'))
+
+    try:
+        stats = merge_profiles(profile_file, profile_dir)
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+    print(f"{BOLD}{BLUE}Profile of the parent and {workers} worker{'s' if workers != 1 else ''} saved to {profile_file}{END}")
+    stats.sort_stats('tottime').print_stats(PROFILE_TOP_FUNCTIONS)
+
 
 def main():
     global terminate_flag
+
+    if len(sys.argv) > 2 and sys.argv[2] == '-':
+        sys.stdout = sys.stderr
     
     MAGENTA = '\033[35m'
     CYAN = '\033[36m'
@@ -531,7 +3321,7 @@ def main():
     BOX_H = '─'
     BOX_V = '│'
     
-    terminal_width = min(80, os.get_terminal_size().columns)
+    terminal_width = min(80, shutil.get_terminal_size().columns)
     box_width = terminal_width - 2
     
     print(f"\n{CYAN}{BOX_TL}{BOX_H * box_width}{BOX_TR}{END}")
@@ -556,23 +3346,178 @@ def main():
         output_file = None
     
     num_processes = None
+    memory_limit_mb = None
+    checkpoint_file = None
+    timings_file = None
+    profile_file = None
+    metrics_file = None
+    metrics_port = None
+    quarantine_file = None
+    serve = False
+    compile_target = None
+    months = None
+    index_file = None
+    host = '127.0.0.1'
+    port = 8765
+    unix_socket = None
     for i, arg in enumerate(sys.argv):
         if arg == "--processes" or arg == "-p":
+            if i + 1 < len(sys.argv):
+                if sys.argv[i + 1] == "auto":
+                    num_processes = "auto"
+                else:
+                    try:
+                        num_processes = int(sys.argv[i + 1])
+                    except ValueError:
+                        pass
+        elif arg == "--memory-limit":
+            if i + 1 < len(sys.argv):
+                try:
+                    memory_limit_mb = parse_memory_size(sys.argv[i + 1])
+                except ValueError:
+                    print(f"Error: --memory-limit expects a size such as 512M or 2G, got '{sys.argv[i + 1]}'.")
+                    sys.exit(1)
+        elif arg == "--checkpoint":
+            if i + 1 < len(sys.argv):
+                checkpoint_file = sys.argv[i + 1]
+        elif arg == "--timings":
+            if i + 1 < len(sys.argv):
+                timings_file = sys.argv[i + 1]
+        elif arg == "--profile":
+            if i + 1 < len(sys.argv):
+                profile_file = sys.argv[i + 1]
+        elif arg == "--metrics":
+            if i + 1 < len(sys.argv):
+                metrics_file = sys.argv[i + 1]
+        elif arg == "--metrics-port":
+            if i + 1 < len(sys.argv):
+                try:
+                    metrics_port = int(sys.argv[i + 1])
+                except ValueError:
+                    pass
+        elif arg == "--quarantine":
+            if i + 1 < len(sys.argv):
+                quarantine_file = sys.argv[i + 1]
+        elif arg == "--months":
+            if i + 1 < len(sys.argv):
+                months = sys.argv[i + 1]
+        elif arg == "--index":
+            if i + 1 < len(sys.argv):
+                index_file = sys.argv[i + 1]
+        elif arg == "--compile":
+            if i + 1 < len(sys.argv):
+                compile_target = sys.argv[i + 1]
+        elif arg == "--serve":
+            serve = True
+        elif arg == "--host":
+            if i + 1 < len(sys.argv):
+                host = sys.argv[i + 1]
+        elif arg == "--port":
             if i + 1 < len(sys.argv):
                 try:
-                    num_processes = int(sys.argv[i + 1])
+                    port = int(sys.argv[i + 1])
                 except ValueError:
                     pass
+        elif arg == "--socket":
+            if i + 1 < len(sys.argv):
+                unix_socket = sys.argv[i + 1]
+
+    if serve:
+        run_pricing_server(host, port, unix_socket)
+        return
+
+    if months:
+        try:
+            months = sorted({datetime.strptime(month.strip(), "%Y-%m").strftime("%Y-%m") for month in months.split(',')})
+        except ValueError:
+            print(f"Error: --months expects comma-separated YYYY-MM values, got '{months}'.")
+            sys.exit(1)
+
+    elif index_file:
+        GREEN = '\033[32m'
+        BOLD = '\033[1m'
+        END = '\033[0m'
+        if get_file_size(input_file) and (is_compiled_file(input_file) or detect_compression(input_file)):
+            print("Error: --index requires an uncompressed text input file.")
+            sys.exit(1)
+        run_stats = RunStats()
+        index = build_month_index(input_file, num_processes)
+        save_month_index(index_file, index)
+        run_stats.end()
+        print(f"{BOLD}{GREEN}Indexed {len(index['months']):,} months into {index_file} "
+              f"in {run_stats.format_elapsed_time()}{END}")
+        return
+
+    if compile_target:
+        GREEN = '\033[32m'
+        BOLD = '\033[1m'
+        END = '\033[0m'
+        if get_file_size(input_file) and (is_compiled_file(input_file) or detect_compression(input_file)):
+            print("Error: --compile requires an uncompressed text input file.")
+            sys.exit(1)
+        run_stats = RunStats()
+        rows = compile_input_file(input_file, compile_target)
+        run_stats.end()
+        print(f"{BOLD}{GREEN}Compiled {rows:,} transactions into {compile_target} "
+              f"({get_file_size(compile_target) / (1024 * 1024):,.1f} MB) in {run_stats.format_elapsed_time()}{END}")
+        return
     
-    if output_file:
-        open(output_file, 'w').close()
+    streaming = input_file == '-' or output_file == '-'
+    if streaming and (checkpoint_file or months or index_file):
+        print("Error: --checkpoint, --months and --index require input and output file paths, not '-'.")
+        sys.exit(1)
+
+    if checkpoint_file and not output_file:
+        print("Error: --checkpoint requires an output file.")
+        sys.exit(1)
+
+    metrics = None
+    if metrics_file or metrics_port is not None:
+        if streaming or months:
+            print("Error: --metrics and --metrics-port are not supported with streaming or --months.")
+            sys.exit(1)
+        metrics = MetricsExporter(metrics_file, metrics_port)
+
+    if timings_file and (streaming or months):
+        print("Error: --timings is not supported with streaming or --months.")
+        sys.exit(1)
+
+    if quarantine_file and (months or not output_file):
+        print("Error: --quarantine requires an output file and is not supported with --months.")
+        sys.exit(1)
+
+    if output_file == '-':
+        CYAN = '\033[36m'
+        BOLD = '\033[1m'
+        END = '\033[0m'
+        print(f"{BOLD}{CYAN}Output will be written to stdout{END}")
+    elif output_file:
+        if not (checkpoint_file and os.path.exists(checkpoint_file)):
+            open(output_file, 'w').close()
         CYAN = '\033[36m'
         BOLD = '\033[1m'
         END = '\033[0m'
         print(f"{BOLD}{CYAN}Output will be saved to: {output_file}{END}")
     
+    profiler = None
+    profile_dir = None
+    if profile_file:
+        profile_dir = tempfile.mkdtemp(prefix='.shipping_profile_', dir=os.path.dirname(os.path.abspath(profile_file)))
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     try:
-        results = process_file_parallel(input_file, output_file, num_processes)
+        try:
+            if streaming:
+                results = process_file_stream(input_file, output_file, quarantine_file)
+            elif months:
+                results = process_selected_months(input_file, output_file, months, index_file, num_processes, profile_dir)
+            else:
+                results = process_file_parallel(input_file, output_file, num_processes, checkpoint_file, memory_limit_mb,
+                                                timings_file, profile_dir, metrics, quarantine_file)
+        finally:
+            if profiler:
+                save_profile(profiler, profile_file, profile_dir)
 
         if terminate_flag or results is None:
             print("Processing terminated. Exiting...")
@@ -600,7 +3545,7 @@ def display_results_summary(results, input_file):
     BOX_H = '─'
     BOX_V = '│'
     
-    terminal_width = min(80, os.get_terminal_size().columns)
+    terminal_width = min(80, shutil.get_terminal_size().columns)
     box_width = terminal_width - 2
     
     print(f"\n{CYAN}{BOX_TL}{BOX_H * box_width}{BOX_TR}{END}")
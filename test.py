@@ -1,13 +1,27 @@
 import unittest
+import io
+import json
+import asyncio
+import contextlib
+import gzip
+import bz2
 import os
+import shutil
+import sys
 import tempfile
 from datetime import datetime
 import importlib.util
 
 spec = importlib.util.spec_from_file_location("shipping_calculator", "shipping_discount_calculator.py")
 shipping_calculator = importlib.util.module_from_spec(spec)
+sys.modules["shipping_calculator"] = shipping_calculator
 spec.loader.exec_module(shipping_calculator)
 
+spec = importlib.util.spec_from_file_location("create_shipping_data", "create_shipping_data.py")
+create_shipping_data = importlib.util.module_from_spec(spec)
+sys.modules["create_shipping_data"] = create_shipping_data
+spec.loader.exec_module(create_shipping_data)
+
 class TestShippingCalculator(unittest.TestCase):
 
     def setUp(self):
@@ -81,6 +95,15 @@ class TestShippingCalculator(unittest.TestCase):
         
         self.assertEqual(self.calculator.lowest_s_price, 1.50)
 
+    def test_price_table_compiled_once(self):
+        size, provider, base_price, static_discount, monthly_rules, suffix = self.calculator.price_table["S MR"]
+        self.assertEqual((size, provider, base_price, static_discount, monthly_rules), ("S", "MR", 2.00, 0.50, ()))
+        self.assertEqual(suffix, " 2.00 -")
+
+        self.assertEqual(len(self.calculator.price_table["L LP"][4]), 1)
+        self.assertEqual(self.calculator.price_table["S LP"][3], 0.0)
+        self.assertNotIn("X LP", self.calculator.price_table)
+
     def test_single_transaction_processing(self):
         line = "2015-02-01 S MR"
         date = datetime.strptime("2015-02-01", "%Y-%m-%d")
@@ -203,5 +226,594 @@ class TestShippingCalculator(unittest.TestCase):
         self.assertEqual(final_price, 0.0)
 
 
+    def test_parallel_matches_sequential_across_chunks(self):
+        sizes = ["S", "M", "L"]
+        providers = ["MR", "LP"]
+        lines = []
+        for i in range(600):
+            month = (i * 7) % 3 + 1
+            day = i % 28 + 1
+            lines.append(f"2015-{month:02d}-{day:02d} {sizes[i % 3]} {providers[(i // 3) % 2]}")
+            if i % 50 == 0:
+                lines.append("2015-02-30 S MR")
+
+        input_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
+        input_file.write("\n".join(lines) + "\n")
+        input_file.close()
+        output_file = input_file.name + ".out"
+
+        try:
+            calculator = shipping_calculator.ShippingCalculator()
+            expected = [calculator.process_transaction(line) for line in lines]
+
+            shipping_calculator.process_file_parallel(input_file.name, output_file, 3)
+
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), expected)
+        finally:
+            os.unlink(input_file.name)
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+
+    def test_timing_report_covers_worker_stages(self):
+        output_file = self.test_file.name + ".out"
+        timings_file = self.test_file.name + ".timings.json"
+
+        try:
+            shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2, timings_file=timings_file)
+
+            with open(timings_file) as f:
+                report = json.load(f)
+
+            self.assertEqual(report['lines_processed'], len(self.test_input))
+            self.assertEqual(report['bytes_processed'], os.path.getsize(self.test_file.name))
+            self.assertIn('summarize', report['worker_totals'])
+            self.assertIn('price', report['worker_totals'])
+            self.assertIn('append', report['parent'])
+        finally:
+            for path in (output_file, timings_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_worker_profiles_are_merged(self):
+        output_file = self.test_file.name + ".out"
+        profile_file = self.test_file.name + ".prof"
+        profile_dir = tempfile.mkdtemp()
+
+        try:
+            shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2, profile_dir=profile_dir)
+            stats = shipping_calculator.merge_profiles(profile_file, profile_dir)
+
+            functions = {function for _, _, function in stats.stats}
+            self.assertIn('process_chunk', functions)
+            self.assertIn('summarize_batches', functions)
+        finally:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            for path in (output_file, profile_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_metrics_export_matches_run(self):
+        output_file = self.test_file.name + ".out"
+        metrics_file = self.test_file.name + ".json"
+
+        try:
+            exporter = shipping_calculator.MetricsExporter(metrics_file)
+            shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2, metrics=exporter)
+
+            with open(metrics_file) as f:
+                metrics = json.load(f)
+
+            self.assertTrue(metrics['finished'])
+            self.assertEqual(metrics['lines_processed'], len(self.test_input))
+            self.assertEqual(metrics['ignored_lines'], 1)
+            self.assertEqual(metrics['bytes_processed'], os.path.getsize(self.test_file.name))
+            self.assertEqual(set(metrics['monthly_discounts']), {"2015-02", "2015-03"})
+
+            text = shipping_calculator.format_prometheus(metrics)
+            self.assertIn(f"shipping_lines_processed_total {len(self.test_input)}", text)
+            self.assertIn('shipping_shipments_by_provider_total{provider="LP"}', text)
+        finally:
+            for path in (output_file, metrics_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_rejected_lines_are_quarantined_by_reason(self):
+        lines = ["2015-02-01 S MR", "2015-02-30 S MR", "2015-02-02 X LP", "2015-02-03 S XX", "2015-02-04 CUSPS",
+                 "2015-02-05 L LP", "invalid-date M MR", "2015-13-01 L MR"] * 50
+        input_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
+        input_file.write("\n".join(lines) + "\n")
+        input_file.close()
+        output_file = input_file.name + ".out"
+        quarantine_file = input_file.name + ".quarantine"
+
+        try:
+            calculator = shipping_calculator.ShippingCalculator()
+            expected = [calculator.process_transaction(line) for line in lines]
+            self.assertEqual(dict(calculator.ignored_reasons),
+                             {'bad_date': 150, 'unknown_size': 50, 'unknown_provider': 50, 'bad_field_count': 50})
+
+            shipping_calculator.process_file_parallel(input_file.name, output_file, 2, quarantine_file=quarantine_file)
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), expected)
+            with open(quarantine_file) as f:
+                quarantined = [line.split("\t") for line in f.read().splitlines()]
+
+            self.assertEqual([line for _, line in quarantined], [line for line in lines if f"{line} Ignored" in expected])
+            self.assertEqual(quarantined[:3], [['bad_date', "2015-02-30 S MR"], ['unknown_size', "2015-02-02 X LP"],
+                                               ['unknown_provider', "2015-02-03 S XX"]])
+        finally:
+            for path in (input_file.name, output_file, quarantine_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_blank_lines_are_quarantined_without_output(self):
+        lines = ["2015-02-01 S MR", "", "2015-02-02 S MR", "   ", "2015-02-03 S XX"]
+        input_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
+        input_file.write("\n".join(lines) + "\n")
+        input_file.close()
+        output_file = input_file.name + ".out"
+        quarantine_file = input_file.name + ".quarantine"
+
+        try:
+            shipping_calculator.process_file_parallel(input_file.name, output_file, 2, quarantine_file=quarantine_file)
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), ["2015-02-01 S MR 1.50 0.50", "2015-02-02 S MR 1.50 0.50",
+                                                         "2015-02-03 S XX Ignored"])
+            with open(quarantine_file) as f:
+                self.assertEqual(f.read().splitlines(), ["bad_field_count\t", "bad_field_count\t",
+                                                         "unknown_provider\t2015-02-03 S XX"])
+        finally:
+            for path in (input_file.name, output_file, quarantine_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_single_process_modes_quarantine_the_same_lines(self):
+        lines = ["2015-02-01 S MR", "2015-02-30 S MR", "2015-02-02 X LP", "2015-02-03 S XX", "2015-02-04 CUSPS",
+                 "2015-02-05 L LP", "invalid-date M MR", "2015-13-01 L MR"] * 50
+        data = ("\n".join(lines) + "\n").encode()
+
+        input_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
+        input_file.write(data)
+        input_file.close()
+        gzip_file = input_file.name + ".gz"
+        compiled_file = input_file.name + ".col"
+        with open(gzip_file, 'wb') as f:
+            f.write(gzip.compress(data))
+        shipping_calculator.compile_input_file(input_file.name, compiled_file)
+
+        paths = [gzip_file, compiled_file]
+        try:
+            expected_file = input_file.name + ".quarantine"
+            paths += [input_file.name + ".out", expected_file]
+            shipping_calculator.process_file_parallel(input_file.name, input_file.name + ".out", 2,
+                                                      quarantine_file=expected_file)
+            with open(expected_file, 'rb') as f:
+                expected = f.read()
+
+            stream_file = input_file.name + ".stream.quarantine"
+            paths += [input_file.name + ".stream.out", stream_file]
+            shipping_calculator.process_file_stream(input_file.name, input_file.name + ".stream.out", stream_file)
+            with open(stream_file, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+
+            for source in (gzip_file, compiled_file):
+                quarantine_file = source + ".quarantine"
+                paths += [source + ".out", quarantine_file]
+                shipping_calculator.process_file_parallel(source, source + ".out", 2, quarantine_file=quarantine_file)
+                with open(quarantine_file, 'rb') as f:
+                    self.assertEqual(f.read(), expected)
+        finally:
+            for path in [input_file.name] + paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_checkpoint_resume_appends_only_new_lines(self):
+        lines = [f"2015-{i % 2 + 2:02d}-{i % 28 + 1:02d} {'SML'[i % 3]} {('MR', 'LP')[(i // 3) % 2]}" for i in range(300)]
+
+        input_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
+        input_file.write("\n".join(lines[:120]) + "\n" + lines[120][:7])
+        input_file.close()
+        output_file = input_file.name + ".out"
+        checkpoint_file = input_file.name + ".ckpt"
+
+        try:
+            calculator = shipping_calculator.ShippingCalculator()
+            expected = [calculator.process_transaction(line) for line in lines]
+
+            shipping_calculator.process_file_parallel(input_file.name, output_file, 2, checkpoint_file)
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), expected[:120])
+
+            with open(input_file.name, 'a') as f:
+                f.write(lines[120][7:] + "\n" + "\n".join(lines[121:]) + "\n")
+            with open(output_file, 'a') as f:
+                f.write("partial output from an interrupted run\n")
+
+            shipping_calculator.process_file_parallel(input_file.name, output_file, 2, checkpoint_file)
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), expected)
+        finally:
+            for path in (input_file.name, output_file, checkpoint_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_checkpoint_without_output_is_not_resumed_into_a_file(self):
+        output_file = self.test_file.name + ".out"
+        checkpoint_file = self.test_file.name + ".ckpt"
+
+        try:
+            shipping_calculator.process_file_parallel(self.test_file.name, None, 2, checkpoint_file)
+            self.assertTrue(os.path.exists(checkpoint_file))
+
+            self.assertIsNone(shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2,
+                                                                        checkpoint_file))
+            self.assertFalse(os.path.exists(output_file))
+        finally:
+            for path in (output_file, checkpoint_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_checkpoint_refuses_missing_output(self):
+        output_file = self.test_file.name + ".out"
+        checkpoint_file = self.test_file.name + ".ckpt"
+
+        try:
+            shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2, checkpoint_file)
+            os.unlink(output_file)
+
+            self.assertIsNone(shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2,
+                                                                        checkpoint_file))
+            self.assertFalse(os.path.exists(output_file))
+        finally:
+            for path in (output_file, checkpoint_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_checkpoint_refuses_short_output(self):
+        output_file = self.test_file.name + ".out"
+        checkpoint_file = self.test_file.name + ".ckpt"
+
+        try:
+            shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2, checkpoint_file)
+            with open(output_file, 'wb') as f:
+                f.write(b"2015-02-01 S MR 1.50 0.50\n")
+
+            self.assertIsNone(shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2,
+                                                                        checkpoint_file))
+            with open(output_file, 'rb') as f:
+                self.assertEqual(f.read(), b"2015-02-01 S MR 1.50 0.50\n")
+        finally:
+            for path in (output_file, checkpoint_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_checkpoint_without_quarantine_is_not_resumed_with_one(self):
+        output_file = self.test_file.name + ".out"
+        quarantine_file = self.test_file.name + ".quarantine"
+        checkpoint_file = self.test_file.name + ".ckpt"
+
+        try:
+            shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2, checkpoint_file)
+            with open(quarantine_file, 'wb') as f:
+                f.write(b"bad_date\t2015-02-30 S MR\n")
+
+            self.assertIsNone(shipping_calculator.process_file_parallel(self.test_file.name, output_file, 2, checkpoint_file,
+                                                                        quarantine_file=quarantine_file))
+            with open(quarantine_file, 'rb') as f:
+                self.assertEqual(f.read(), b"bad_date\t2015-02-30 S MR\n")
+        finally:
+            for path in (output_file, quarantine_file, checkpoint_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_stream_matches_sequential(self):
+        data = ("\n".join(self.test_input) + "\n\n2015-03-02 L LP").encode()
+        calculator = shipping_calculator.ShippingCalculator()
+        expected = [result for result in (calculator.process_transaction(line) for line in data.decode().split("\n")) if result]
+
+        for block_size in (1, 7, 64, len(data)):
+            output = io.BytesIO()
+            shipping_calculator.process_stream(io.BytesIO(data), output, block_size=block_size)
+            self.assertEqual(output.getvalue().decode().splitlines(), expected)
+
+
+    def test_pricing_server_keeps_state_across_connections(self):
+        calculator = shipping_calculator.ShippingCalculator()
+        expected = [calculator.process_transaction(line) for line in self.test_input]
+
+        async def exchange(port, lines):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(("\n".join(lines) + "\n").encode())
+            writer.write_eof()
+            response = await reader.read()
+            writer.close()
+            return response.decode().splitlines()
+
+        async def run():
+            server = shipping_calculator.PricingServer()
+            listener = await server.start('127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+
+            try:
+                first = await exchange(port, self.test_input[:10])
+                second = await exchange(port, self.test_input[10:])
+            finally:
+                await server.stop()
+            return first + second
+
+        self.assertEqual(asyncio.run(run()), expected)
+
+
+    def test_compressed_input_matches_plain(self):
+        data = ("\n".join(self.test_input * 20) + "\n").encode()
+        calculator = shipping_calculator.ShippingCalculator()
+        expected = [result for result in (calculator.process_transaction(line) for line in self.test_input * 20) if result]
+
+        compressed_inputs = {
+            '.gz': gzip.compress(data),
+            '.bz2': b''.join(bz2.compress(data[i:i + 100]) for i in range(0, len(data), 100))
+        }
+
+        for suffix, payload in compressed_inputs.items():
+            input_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+            input_file.write(payload)
+            input_file.close()
+            output_file = input_file.name + ".out"
+
+            try:
+                shipping_calculator.process_file_parallel(input_file.name, output_file, 3)
+                with open(output_file) as f:
+                    self.assertEqual(f.read().splitlines(), expected)
+
+                if suffix == '.gz':
+                    timings_file = input_file.name + ".timings.json"
+                    self.assertIsNone(shipping_calculator.process_file_parallel(input_file.name, output_file, 3,
+                                                                                timings_file=timings_file))
+                    self.assertFalse(os.path.exists(timings_file))
+
+                    metrics_file = input_file.name + ".metrics.json"
+                    metrics = shipping_calculator.MetricsExporter(metrics_file)
+                    self.assertIsNone(shipping_calculator.process_file_parallel(input_file.name, output_file, 3,
+                                                                                metrics=metrics))
+                    self.assertFalse(os.path.exists(metrics_file))
+            finally:
+                os.unlink(input_file.name)
+                if os.path.exists(output_file):
+                    os.unlink(output_file)
+
+
+    def test_compiled_input_matches_text(self):
+        lines = self.test_input + ["", "2015-03-02  L LP", "1969-12-31 S MR", "2015-03-03 S MR\r", "2015-03-04 M LP"]
+        calculator = shipping_calculator.ShippingCalculator()
+        expected = [result for result in (calculator.process_transaction(line) for line in lines) if result]
+
+        input_file = tempfile.NamedTemporaryFile(delete=False, mode='w', newline='')
+        input_file.write("\n".join(lines) + "\n")
+        input_file.close()
+        compiled_file = input_file.name + ".col"
+        output_file = input_file.name + ".out"
+
+        try:
+            self.assertEqual(shipping_calculator.compile_input_file(input_file.name, compiled_file), len(lines))
+            self.assertLess(os.path.getsize(compiled_file), os.path.getsize(input_file.name) + 1024)
+
+            shipping_calculator.process_file_parallel(compiled_file, output_file, 2)
+            with open(output_file, newline='') as f:
+                self.assertEqual(f.read().split("\n")[:-1], expected)
+
+            timings_file = input_file.name + ".timings.json"
+            self.assertIsNone(shipping_calculator.process_file_parallel(compiled_file, output_file, 2,
+                                                                        timings_file=timings_file))
+            self.assertFalse(os.path.exists(timings_file))
+        finally:
+            for path in (input_file.name, compiled_file, output_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_selected_months_match_full_run(self):
+        calculator = shipping_calculator.ShippingCalculator()
+        expected = [calculator.process_transaction(line) for line in self.test_input]
+        expected = [result for line, result in zip(self.test_input, expected)
+                    if line.startswith("2015-02") and not result.endswith("Ignored")]
+
+        index_file = self.test_file.name + ".idx"
+        output_file = self.test_file.name + ".out"
+        compiled_file = self.test_file.name + ".col"
+
+        try:
+            shipping_calculator.process_selected_months(self.test_file.name, output_file, ["2015-02"], index_file, 2)
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), expected)
+
+            index = shipping_calculator.load_month_index(index_file, self.test_file.name)
+            self.assertEqual(sorted(index['months']), ["2015-02", "2015-03"])
+
+            shipping_calculator.compile_input_file(self.test_file.name, compiled_file)
+            shipping_calculator.process_selected_months(compiled_file, output_file, ["2015-02"])
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), expected)
+        finally:
+            for path in (index_file, output_file, compiled_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_generated_data_is_seeded_and_respects_invalid_rate(self):
+        paths = [self.test_file.name + suffix for suffix in (".gen1", ".gen2", ".gen3")]
+        size_gb = 2 / 1024
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                first = create_shipping_data.generate_large_input_file(paths[0], size_gb, seed=7, invalid_rate=0.1)
+                create_shipping_data.generate_large_input_file(paths[1], size_gb, seed=7, invalid_rate=0.1, processes=2)
+                create_shipping_data.generate_large_input_file(paths[2], size_gb, seed=8, invalid_rate=0.1)
+
+            contents = []
+            for path in paths:
+                with open(path, 'rb') as f:
+                    contents.append(f.read())
+            self.assertEqual(contents[0], contents[1])
+            self.assertNotEqual(contents[0], contents[2])
+
+            lines = contents[0].split(b'\n')[:-1]
+            self.assertEqual(len(lines), first['lines'])
+            calculator = shipping_calculator.ShippingCalculator()
+            calculator.process_batch(lines)
+            self.assertAlmostEqual(calculator.ignored_lines / len(lines), 0.1, delta=0.01)
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def test_task_count_scales_with_input_size(self):
+        task_bytes = shipping_calculator.TASK_CHUNK_BYTES
+        min_tasks = shipping_calculator.MIN_TASKS_PER_PROCESS
+
+        self.assertEqual(shipping_calculator.count_tasks(1000, 4), 4 * min_tasks)
+        self.assertEqual(shipping_calculator.count_tasks(task_bytes * 100 + 1, 4), 101)
+
+
+    def test_auto_tune_respects_limits(self):
+        self.assertEqual(shipping_calculator.parse_memory_size("512M"), 512)
+        self.assertEqual(shipping_calculator.parse_memory_size("2GB"), 2048)
+        with self.assertRaises(ValueError):
+            shipping_calculator.parse_memory_size("lots")
+
+        file_size = os.path.getsize(self.test_file.name)
+        tuning = shipping_calculator.auto_tune(self.test_file.name, file_size, memory_limit_mb=1, max_processes=8)
+
+        self.assertEqual(tuning['processes'], 1)
+        self.assertEqual(tuning['batch_lines'], shipping_calculator.AUTO_TUNE_BATCH_SIZES[0])
+        self.assertGreater(tuning['core_lines_per_second'], 0)
+
+        tuning = shipping_calculator.auto_tune(self.test_file.name, file_size, max_processes=8)
+        self.assertEqual((tuning['processes'], tuning['limited_by']), (1, 'file size'))
+        self.assertEqual(tuning['batch_lines'], shipping_calculator.OUTPUT_BATCH_LINES)
+        self.assertGreater(tuning['core_lines_per_second'], 0)
+
+        self.assertEqual(shipping_calculator.auto_tune_sample_bytes(file_size), shipping_calculator.AUTO_TUNE_MIN_SAMPLE_BYTES)
+        self.assertEqual(shipping_calculator.auto_tune_sample_bytes(1 << 40), shipping_calculator.AUTO_TUNE_SAMPLE_BYTES)
+
+
+    def test_chunk_boundaries_align_to_lines(self):
+        file_size = os.path.getsize(self.test_file.name)
+        boundaries = shipping_calculator.compute_chunk_boundaries(self.test_file.name, file_size, 4)
+
+        self.assertEqual(boundaries[0][0], 0)
+        self.assertEqual(boundaries[-1][1], file_size)
+
+        lines = []
+        for start_offset, end_offset in boundaries:
+            chunk = shipping_calculator.read_chunk_from_file(self.test_file.name, start_offset, end_offset)
+            lines.extend(line.decode().rstrip("\n") for line in chunk)
+
+        self.assertEqual(lines, self.test_input)
+
+
+    def test_cached_month_keys_keep_ignored_semantics(self):
+        calculator = shipping_calculator.ShippingCalculator()
+
+        for _ in range(2):
+            self.assertEqual(calculator.process_transaction("2015-02-29 S MR"), "2015-02-29 S MR Ignored")
+            self.assertEqual(calculator.process_transaction("2015-2-28 S LP"), "2015-2-28 S LP 1.50 -")
+
+        self.assertEqual(calculator.parse_month_key("2016-02-29"), "2016-02")
+        self.assertIsNone(calculator.parse_month_key("not-a-date"))
+        self.assertEqual(calculator.ignored_lines, 2)
+
+
+    def test_process_batch_matches_scalar(self):
+        lines = self.test_input * 3 + [
+            "", "2015-2-3 S MR", " 2015-02-04  L   LP ", "2015-13-01 S MR",
+            "2016-02-29 S MR", "2015-02-05 S MR\n", "2015-02-05 S MR extra"
+        ] + [f"2015-04-{i % 28 + 1:02d} L LP" for i in range(40)]
+
+        scalar = shipping_calculator.ShippingCalculator()
+        expected = [scalar.process_transaction(line) for line in lines]
+
+        batch = shipping_calculator.ShippingCalculator()
+        results = batch.process_batch(lines[:25]) + batch.process_batch(lines[25:])
+
+        self.assertEqual(results, expected)
+        self.assertEqual(dict(batch.monthly_discounts), dict(scalar.monthly_discounts))
+        self.assertEqual(dict(batch.monthly_lp_l_count), dict(scalar.monthly_lp_l_count))
+        self.assertEqual(dict(batch.provider_counts), dict(scalar.provider_counts))
+        self.assertEqual(batch.ignored_lines, scalar.ignored_lines)
+
+
+    def test_custom_monthly_rule(self):
+        rules = shipping_calculator.default_discount_rules()
+        rules.insert(2, shipping_calculator.NthShipmentRule('M', 'MR', 5, fraction=0.5, repeat=True))
+
+        calculator = shipping_calculator.ShippingCalculator(rules)
+        results = [calculator.process_transaction(f"2015-05-{i + 1:02d} M MR") for i in range(10)]
+
+        self.assertEqual(results[3], "2015-05-04 M MR 3.00 -")
+        self.assertEqual(results[4], "2015-05-05 M MR 1.50 1.50")
+        self.assertEqual(results[9], "2015-05-10 M MR 1.50 1.50")
+        self.assertEqual(calculator.monthly_mr_m_count["2015-05"], 10)
+        self.assertEqual(calculator.monthly_discounts["2015-05"], 3.00)
+
+        lines = [f"2015-05-{i % 28 + 1:02d} {'SML'[i % 3]} {('MR', 'LP')[i % 2]}" for i in range(200)]
+        scalar = shipping_calculator.ShippingCalculator(rules)
+        batch = shipping_calculator.ShippingCalculator(rules)
+        self.assertEqual(batch.process_batch(lines), [scalar.process_transaction(line) for line in lines])
+
+
+    def test_batch_summaries_match_line_summaries(self):
+        rules = shipping_calculator.default_discount_rules()
+        rules.insert(2, shipping_calculator.NthShipmentRule('M', 'MR', 5, fraction=0.5, repeat=True))
+        lines = [f"2015-{i % 4 + 1:02d}-{i % 28 + 1:02d} {'SML'[i % 3]} {('MR', 'LP')[i % 7 % 2]}".encode()
+                 for i in range(900)] + [b"2015-02-30 S MR", b"", b"2015-03-01 X LP"]
+
+        calculator = shipping_calculator.ShippingCalculator(rules)
+        threshold = calculator.get_saturation_threshold()
+        expected = {}
+        for line in lines:
+            calculator.summarize_line(line, expected, threshold)
+
+        for batch_lines in (1, 64, 1000):
+            calculator = shipping_calculator.ShippingCalculator(rules)
+            summaries = {}
+            for i in range(0, len(lines), batch_lines):
+                calculator.summarize_batch(lines[i:i + batch_lines], summaries, threshold)
+
+            self.assertEqual({month: (summary.events, dict(summary.counts)) for month, summary in summaries.items()},
+                             {month: (summary.events, dict(summary.counts)) for month, summary in expected.items()})
+
+
+    def test_bytes_fast_path_matches_text_path(self):
+        lines = [line.encode() + b"\n" for line in self.test_input] + [
+            b"\n", b"2015-02-1\t S MR\n", b"2015-02-30 S MR\n", b"2015-02-05 S MR\r\n",
+            b"2015-02-05 S MR", b"\xff\xfe S MR\n"
+        ]
+
+        text = shipping_calculator.ShippingCalculator()
+        expected = [text.process_transaction(line.decode('utf-8', 'surrogateescape')).encode('utf-8', 'surrogateescape')
+                    for line in lines]
+
+        scalar = shipping_calculator.ShippingCalculator()
+        self.assertEqual([scalar.process_transaction_bytes(line) for line in lines], expected)
+
+        batch = shipping_calculator.ShippingCalculator()
+        self.assertEqual(batch.process_batch(lines), expected)
+        self.assertEqual(batch.ignored_lines, text.ignored_lines)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file